@@ -27,6 +27,18 @@ export interface TraFile {
 	framerate: number;
 }
 
+// Response of /trajectory?from=F0&to=F1 and /trajectory?frame=F
+export interface TraWindow {
+	from: number;
+	to: number;
+	framerate: number;
+	frames: {frame: number, locations: location[]}[];
+}
+
+interface location extends frame {
+	id: string
+}
+
 interface pedestrian {
 	frames: frame[];
 }
@@ -48,3 +60,116 @@ interface ab {
 	A: number,
 	B: number
 }
+
+// Column buffers of /trajectory.bin, see src/server/trajectory.py for the layout
+export interface TraColumns {
+	framerate: number;
+	frameCount: number;
+	pedestrianCount: number;
+	id: Int32Array;
+	frame: Int32Array;
+	x: Float32Array;
+	y: Float32Array;
+	z: Float32Array;
+	A: Float32Array;
+	B: Float32Array;
+	angle: Float32Array;
+	color: Float32Array;
+	// Rows of the k-th pedestrian are offsets[k] .. offsets[k + 1] - 1
+	offsets: Uint32Array;
+}
+
+const BINARY_MAGIC = 'JPST';
+const BINARY_HEADER_SIZE = 28;
+const QUANTIZED_VERSION = 2;
+const QUANTIZED_HEADER_SIZE = 40;
+const ANGLE_STEP = 0.01;
+
+/** Wrap the buffers of /trajectory.bin in typed arrays without copying. */
+export function decodeTrajectory(buffer: ArrayBuffer): TraColumns {
+	const view = new DataView(buffer);
+	const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+	if (magic !== BINARY_MAGIC) {
+		throw new Error(`Not a trajectory buffer: ${magic}`);
+	}
+	if (view.getUint32(4, true) === QUANTIZED_VERSION) {
+		return decodeQuantizedTrajectory(buffer);
+	}
+
+	const framerate = view.getFloat32(8, true);
+	const rows = view.getUint32(12, true);
+	const frameCount = view.getUint32(16, true);
+	const pedestrianCount = view.getUint32(20, true);
+	const columnOffset = (i: number) => view.getUint32(BINARY_HEADER_SIZE + 4 * i, true);
+
+	// Typed arrays use the platform byte order; the payload is little-endian
+	// like every browser platform in use.
+	return {
+		framerate: framerate,
+		frameCount: frameCount,
+		pedestrianCount: pedestrianCount,
+		id: new Int32Array(buffer, columnOffset(0), rows),
+		frame: new Int32Array(buffer, columnOffset(1), rows),
+		x: new Float32Array(buffer, columnOffset(2), rows),
+		y: new Float32Array(buffer, columnOffset(3), rows),
+		z: new Float32Array(buffer, columnOffset(4), rows),
+		A: new Float32Array(buffer, columnOffset(5), rows),
+		B: new Float32Array(buffer, columnOffset(6), rows),
+		angle: new Float32Array(buffer, columnOffset(7), rows),
+		color: new Float32Array(buffer, columnOffset(8), rows),
+		offsets: new Uint32Array(buffer, columnOffset(9), pedestrianCount + 1)
+	}
+}
+
+/** Expand the quantized layout of /trajectory.bin?quantize= into float columns. */
+function decodeQuantizedTrajectory(buffer: ArrayBuffer): TraColumns {
+	const view = new DataView(buffer);
+	const framerate = view.getFloat32(8, true);
+	const rows = view.getUint32(12, true);
+	const frameCount = view.getUint32(16, true);
+	const pedestrianCount = view.getUint32(20, true);
+	const step = view.getFloat32(28, true);
+	const coordinateBytes = view.getUint32(32, true);
+	const columnOffset = (i: number) => view.getUint32(QUANTIZED_HEADER_SIZE + 4 * i, true);
+	const coordinates = (i: number) => coordinateBytes === 2 ?
+		new Int16Array(buffer, columnOffset(i), rows) : new Int32Array(buffer, columnOffset(i), rows);
+	const offsets = new Uint32Array(buffer, columnOffset(9), pedestrianCount + 1);
+
+	// Positions are differences along the path of each pedestrian
+	const positions = (column: number, firstColumn: number) => {
+		const deltas = coordinates(column);
+		const firsts = new Int32Array(buffer, columnOffset(firstColumn), pedestrianCount);
+		const values = new Float32Array(rows);
+		for (let k = 0; k < pedestrianCount; k++) {
+			let value = firsts[k];
+			for (let row = offsets[k]; row < offsets[k + 1]; row++) {
+				value += deltas[row];
+				values[row] = value * step;
+			}
+		}
+		return values;
+	};
+	const scaled = (values: Int16Array | Int32Array | Uint8Array, scale: number) => {
+		const result = new Float32Array(rows);
+		for (let row = 0; row < rows; row++) {
+			result[row] = values[row] * scale;
+		}
+		return result;
+	};
+
+	return {
+		framerate: framerate,
+		frameCount: frameCount,
+		pedestrianCount: pedestrianCount,
+		id: new Int32Array(buffer, columnOffset(0), rows),
+		frame: new Int32Array(buffer, columnOffset(1), rows),
+		x: positions(2, 10),
+		y: positions(3, 11),
+		z: positions(4, 12),
+		A: scaled(coordinates(5), step),
+		B: scaled(coordinates(6), step),
+		angle: scaled(new Int16Array(buffer, columnOffset(7), rows), ANGLE_STEP),
+		color: scaled(new Uint8Array(buffer, columnOffset(8), rows), 1),
+		offsets: offsets
+	}
+}
@@ -8,19 +8,20 @@ import pathlib
 PROJ_ROOT = pathlib.Path(__file__).parent.parent
 
 
-def plot_Nt(file):
+def plot_Nt(file, data_NT=None, figname='N_t.png'):
     fig = plt.figure(figsize=(16, 16), dpi=72)
     ax1 = fig.add_subplot(111, aspect='auto')
     plt.rc("font", size=30)
     plt.rc('pdf', fonttype=42)
     data_file = file
-    if not os.path.exists(data_file):
-        return "Not found the N_t.dat file"
+    if data_NT is None:
+        if not os.path.exists(data_file):
+            return "Not found the N_t.dat file"
+        data_NT = loadtxt(data_file)
 
-    data_NT = loadtxt(data_file)
     plt.plot(data_NT[:, 0], data_NT[:, 1], 'r-')
     plt.xlabel("t [s]")
     plt.ylabel("N [-]")
     plt.title("N_t")
-    plt.savefig('N_t.png')
+    plt.savefig(figname)
     plt.close()
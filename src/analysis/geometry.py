@@ -0,0 +1,284 @@
+#  \file geometry.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+
+# Geometry model shared by the server and the analysis scripts.
+#
+# A JuPedSim geometry file is read in one streaming ElementTree pass that
+# collects the wall and obstacle polygons as flat vertex arrays and, at
+# the same time, builds the JSON document served by /geometry.
+import json
+import os
+from xml.etree import ElementTree as ET
+
+import numpy as np
+
+# Arrays of the model, persisted as <name>.npy by Geometry.save
+ARRAYS = ['wall_vertices', 'wall_offsets', 'obstacle_vertices',
+          'obstacle_polygon_offsets', 'obstacle_offsets']
+
+# geo_filename -> (mtime_ns, size, Geometry)
+loaded = {}
+
+
+def polygon_bboxes(vertices, offsets):
+    """ Bounding box of every polygon of a flat vertex array
+
+    :param vertices: (n, 2) vertices of all polygons
+    :param offsets: the vertices of polygon k are vertices[offsets[k]:offsets[k + 1]]
+    :returns: (polygons, 4) array of [minX, maxX, minY, maxY], NaN for empty polygons
+    """
+    bboxes = np.full((len(offsets) - 1, 4), np.nan)
+    nonempty = np.flatnonzero(np.diff(offsets) > 0)
+    if len(nonempty):
+        starts = offsets[nonempty]
+        bboxes[nonempty, 0] = np.minimum.reduceat(vertices[:, 0], starts)
+        bboxes[nonempty, 1] = np.maximum.reduceat(vertices[:, 0], starts)
+        bboxes[nonempty, 2] = np.minimum.reduceat(vertices[:, 1], starts)
+        bboxes[nonempty, 3] = np.maximum.reduceat(vertices[:, 1], starts)
+    return bboxes
+
+
+def split_polygons(vertices, offsets):
+    """ List of (n_k, 2) vertex arrays, views into <vertices> """
+    return [vertices[offsets[k]:offsets[k + 1]] for k in range(len(offsets) - 1)]
+
+
+class Geometry:
+    """ Walls and obstacles of a geometry file as contiguous arrays
+
+    The vertices of wall k are wall_vertices[wall_offsets[k]:wall_offsets[k + 1]].
+    Walls are the polygons with caption "wall" inside a subroom, in file order.
+
+    Obstacle polygons are stored the same way (obstacle_vertices,
+    obstacle_polygon_offsets), and obstacle j owns the polygons
+    obstacle_offsets[j]:obstacle_offsets[j + 1].
+    """
+
+    def __init__(self, wall_vertices, wall_offsets, obstacle_vertices,
+                 obstacle_polygon_offsets, obstacle_offsets, json_text):
+        self.wall_vertices = wall_vertices
+        self.wall_offsets = wall_offsets
+        self.obstacle_vertices = obstacle_vertices
+        self.obstacle_polygon_offsets = obstacle_polygon_offsets
+        self.obstacle_offsets = obstacle_offsets
+        self.json_text = json_text
+
+    @classmethod
+    def parse(cls, geo_filename):
+        """ Read a geometry file in a single pass """
+        builder = DocumentBuilder()
+        for event, item in ET.iterparse(geo_filename, events=('start-ns', 'start', 'end')):
+            if event == 'start-ns':
+                builder.start_ns(*item)
+            elif event == 'start':
+                builder.start(item)
+            else:
+                builder.end(item)
+        return builder.geometry()
+
+    def save(self, directory):
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'geometry.json'), 'w', encoding='utf-8') as f:
+            f.write(self.json_text)
+
+    @classmethod
+    def load(cls, directory):
+        arrays = [np.load(os.path.join(directory, name + '.npy')) for name in ARRAYS]
+        with open(os.path.join(directory, 'geometry.json'), encoding='utf-8') as f:
+            return cls(*arrays, f.read())
+
+    def to_json(self):
+        """ The document served by /geometry: the XML as nested objects,
+        attributes as plain keys and repeated elements as lists """
+        return self.json_text
+
+    def walls(self):
+        """ {n: (n_vertex, 2) array} of the walls, numbered from 1 in file order """
+        return {k + 1: wall for k, wall in enumerate(split_polygons(self.wall_vertices, self.wall_offsets))}
+
+    def wall_bboxes(self):
+        return polygon_bboxes(self.wall_vertices, self.wall_offsets)
+
+    def obstacle_bboxes(self):
+        """ Bounding box of every obstacle (over all its polygons) """
+        polygons = polygon_bboxes(self.obstacle_vertices, self.obstacle_polygon_offsets)
+        bboxes = np.full((len(self.obstacle_offsets) - 1, 4), np.nan)
+        for j in range(len(bboxes)):
+            own = polygons[self.obstacle_offsets[j]:self.obstacle_offsets[j + 1]]
+            if len(own) and not np.all(np.isnan(own[:, 0])):
+                bboxes[j] = [np.nanmin(own[:, 0]), np.nanmax(own[:, 1]),
+                             np.nanmin(own[:, 2]), np.nanmax(own[:, 3])]
+        return bboxes
+
+    def obstacle_outlines(self):
+        """ Outline of every obstacle as one ragged array
+
+        The vertices of all polygons of an obstacle are deduplicated and
+        ordered by their angle around the centroid, for all obstacles at
+        once. Returns (vertices, offsets), the outline of obstacle j is
+        vertices[offsets[j]:offsets[j + 1]].
+        """
+        n_obstacles = len(self.obstacle_offsets) - 1
+        polygon_obstacle = np.repeat(np.arange(n_obstacles), np.diff(self.obstacle_offsets))
+        owner = np.repeat(polygon_obstacle, np.diff(self.obstacle_polygon_offsets))
+        x = self.obstacle_vertices[:, 0]
+        y = self.obstacle_vertices[:, 1]
+
+        # Unique vertices per obstacle, sorted by x then y like np.unique(axis=0)
+        order = np.lexsort((y, x, owner))
+        owner, x, y = owner[order], x[order], y[order]
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = (owner[1:] != owner[:-1]) | (x[1:] != x[:-1]) | (y[1:] != y[:-1])
+        owner, x, y = owner[keep], x[keep], y[keep]
+
+        counts = np.bincount(owner, minlength=n_obstacles)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            center_x = np.bincount(owner, weights=x, minlength=n_obstacles) / counts
+            center_y = np.bincount(owner, weights=y, minlength=n_obstacles) / counts
+        angles = np.arctan2(x - center_x[owner], y - center_y[owner])
+
+        order = np.lexsort((angles, owner))
+        offsets = np.zeros(n_obstacles + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return np.column_stack([x[order], y[order]]), offsets
+
+    def bounds(self):
+        """ geominX, geomaxX, geominY, geomaxY over all walls """
+        if len(self.wall_vertices) == 0:
+            raise ValueError('geometry has no walls')
+        minimum = np.min(self.wall_vertices, axis=0)
+        maximum = np.max(self.wall_vertices, axis=0)
+        return minimum[0], maximum[0], minimum[1], maximum[1]
+
+
+class DocumentBuilder:
+    """ Element callbacks of Geometry.parse
+
+    Builds the JSON document with the conventions of xmltodict (attributes
+    without prefix, text as '#text' next to attributes, repeated children
+    as lists) and collects the polygon vertices on the way.
+    """
+
+    def __init__(self):
+        self.namespaces = {}
+        self.new_namespaces = []
+        # (tag, value dictionary) of the open elements
+        self.stack = [(None, {})]
+        self.tags = []
+
+        self.vertices = {'wall': [], 'obstacle': []}
+        self.polygon_offsets = {'wall': [0], 'obstacle': [0]}
+        self.obstacle_offsets = [0]
+        self.polygon = None
+
+    def name(self, tag):
+        """ Qualified name as written in the file, e.g. xsi:noNamespaceSchemaLocation """
+        if tag.startswith('{'):
+            uri, local = tag[1:].split('}', 1)
+            prefix = self.namespaces.get(uri)
+            return '{}:{}'.format(prefix, local) if prefix else local
+        return tag
+
+    def start_ns(self, prefix, uri):
+        self.namespaces[uri] = prefix
+        self.new_namespaces.append((prefix, uri))
+
+    def start(self, element):
+        value = {}
+        for prefix, uri in self.new_namespaces:
+            value['xmlns:' + prefix if prefix else 'xmlns'] = uri
+        self.new_namespaces = []
+        for key, attribute in element.attrib.items():
+            value[self.name(key)] = attribute
+
+        tag = self.name(element.tag)
+        if tag == 'polygon':
+            self.polygon = []
+        elif tag == 'vertex' and self.polygon is not None:
+            self.polygon.append((float(element.get('px')), float(element.get('py'))))
+        elif tag == 'obstacle':
+            self.obstacle_offsets.append(self.obstacle_offsets[-1])
+
+        self.stack.append((tag, value))
+        self.tags.append(tag)
+
+    def end(self, element):
+        tag, value = self.stack.pop()
+        self.tags.pop()
+        if tag == 'polygon':
+            self.end_polygon(value)
+
+        # Character data of the element, including the text between children
+        text = ''.join([element.text or ''] + [child.tail or '' for child in element]).strip()
+        # The children are part of the document now, free them
+        del element[:]
+        if text:
+            if value:
+                value['#text'] = text
+            else:
+                value = text
+        elif not value:
+            value = None
+
+        parent = self.stack[-1][1]
+        if tag not in parent:
+            parent[tag] = value
+        elif isinstance(parent[tag], list):
+            parent[tag].append(value)
+        else:
+            parent[tag] = [parent[tag], value]
+
+    def end_polygon(self, attributes):
+        if 'obstacle' in self.tags:
+            kind = 'obstacle'
+            self.obstacle_offsets[-1] += 1
+        elif 'subroom' in self.tags and attributes.get('caption') == 'wall':
+            kind = 'wall'
+        else:
+            kind = None
+
+        if kind is not None:
+            self.vertices[kind].extend(self.polygon)
+            self.polygon_offsets[kind].append(len(self.vertices[kind]))
+        self.polygon = None
+
+    def geometry(self):
+        def vertex_array(kind):
+            return np.array(self.vertices[kind], dtype=np.float64).reshape(-1, 2)
+
+        return Geometry(vertex_array('wall'),
+                        np.array(self.polygon_offsets['wall'], dtype=np.int64),
+                        vertex_array('obstacle'),
+                        np.array(self.polygon_offsets['obstacle'], dtype=np.int64),
+                        np.array(self.obstacle_offsets, dtype=np.int64),
+                        json.dumps(self.stack[0][1], ensure_ascii=False))
+
+
+def load_geometry(geo_filename):
+    """ Geometry of a file, parsed again only when its mtime or size change """
+    stat = os.stat(geo_filename)
+    cached = loaded.get(geo_filename)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    geometry = Geometry.parse(geo_filename)
+    loaded[geo_filename] = (stat.st_mtime_ns, stat.st_size, geometry)
+    return geometry
@@ -1,17 +1,22 @@
 import os
+import sys
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-from matplotlib.patches import Polygon as ppolygon # polygons
+from matplotlib.collections import LineCollection, PolyCollection
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 
 import numpy as np
-import glob
-from xml.dom.minidom import parse
+from multiprocessing import Pool
 
 from Utilities import read_obstacle
-from Utilities import read_subroom_walls
-from Utilities import geo_limits
+from Utilities import load_prf_stack
+from Utilities import prf_window_mean
+from Utilities import plot_geometry
+from Utilities import read_IFD_polygons
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from analysis.geometry import load_geometry
 
 def plot_nt(measurement_id, files):
     """plot N(t) curves (Method A)
@@ -43,71 +48,40 @@ def plot_nt(measurement_id, files):
     plt.savefig(figname)
     print("---> ", figname)
 
-def get_profiles(Id, field_dir, geo_filename, beginsteady=None, endsteady=None):
+def get_profiles(Id, field_dir, geo_filename, beginsteady=None, endsteady=None, cache_dir=None):
     """ Plot density, velocity and flow
 
     Note: J = rho*v
 
+    The profiles are parsed once into stacks (see load_prf_stack) written
+    to <cache_dir>/<quantity>, by default next to the profile files in
+    <field_dir>/density and <field_dir>/velocity.
+
     :param Id: measurement area
     :param field_dir:
     :param beginsteady: From frame. If None, then take first frame
     :param endsteady: End frame. If None, then take last frame
     :param geo_filename: geometry file as parsed from the inifile
+    :param cache_dir: directory of the profile stacks
     :returns: png-plot
     :rtype:
 
     """
 
-    density_files = os.path.join(field_dir, "density",  "Prf_*id_{}_*".format(Id))
-    velocity_files = os.path.join(field_dir, "velocity",  "Prf_*id_{}_*".format(Id))
-    v_Voronoi = glob.glob(velocity_files)
-    f_Voronoi = glob.glob(density_files)
-    # get frames
-    frames = []
-    for f in v_Voronoi:
-        frame = int(f.split("_")[-1].split(".")[0]) #Prf_d_*_id_%d_%.5d.dat
-        frames.append(frame)
-
-    frames = sorted(frames)
-    # correct arguments if necessary
-    if beginsteady is None:
-        beginsteady = frames[0]
-    elif beginsteady < frames[0]:
-        beginsteady = frames[0]
-
-    if endsteady is None:
-        endsteady = frames[-1]
-    elif endsteady > frames[-1]:
-        endsteady = frames[-1]
-
-    beginsteady -= frames[0]
-    endsteady -= frames[0]
-
-    # get the shape of the matrices
-    shape = np.shape(np.loadtxt(f_Voronoi[0]))
-    density = np.zeros(shape)
-    velocity = np.zeros(shape)
-    xml_datei = open(geo_filename, "r")
-    geo_xml = parse(xml_datei)
-    xml_datei.close()
-    geominX, geomaxX, geominY, geomaxY = geo_limits(geo_xml)
-
-    geometry_wall = read_subroom_walls(geo_xml)
-    geometry_obst = read_obstacle(geo_xml)
-#  -------- density
-    for density_file in f_Voronoi[beginsteady:endsteady+1]:
-        if os.path.exists(density_file):
-            density += np.loadtxt(density_file)
-
-    density = density / (endsteady-beginsteady)
-#  --------- velocity
-    for velocity_file in v_Voronoi[beginsteady:endsteady+1]:
-        if os.path.exists(velocity_file):
-            velocity += np.loadtxt(velocity_file)
-
-    velocity = velocity / (endsteady-beginsteady)
+    stack_dirs = {quantity: None if cache_dir is None else os.path.join(cache_dir, quantity)
+                  for quantity in ["density", "velocity"]}
+    frames_d, density_stack = load_prf_stack(field_dir, "density", Id, cache_dir=stack_dirs["density"])
+    frames_v, velocity_stack = load_prf_stack(field_dir, "velocity", Id, cache_dir=stack_dirs["velocity"])
+    density = prf_window_mean(frames_d, density_stack, beginsteady, endsteady)
+    velocity = prf_window_mean(frames_v, velocity_stack, beginsteady, endsteady)
     flow = density * velocity
 
+    geometry = load_geometry(geo_filename)
+    geominX, geomaxX, geominY, geomaxY = geometry.bounds()
+
+    geometry_wall = geometry.walls()
+    geometry_obst = read_obstacle(geometry)
+
  # plot
     figs, axs = plt.subplots(3, 1)
     axs[0].set_aspect('equal')
@@ -162,85 +136,138 @@ def get_profiles(Id, field_dir, geo_filename, beginsteady=None, endsteady=None):
     plt.savefig(figname)
     print("--->", figname)
 
-def IFD_plot_polygon_rho(Id, frame, geo_filename):
+class PolygonFrameRenderer:
+    """ Draw the Voronoi cells of IFD frames, colored by their density
+
+    Geometry, measurement area and colorbar are drawn once; every frame
+    only replaces the cells, which are a single PolyCollection colored
+    from the rho column by the collection's colormap.
+    """
+
+    def __init__(self, IFD_filename, geo_filename, area=None, vmin=0, vmax=6):
+        """
+        :param IFD_filename: IFD file (Method I) with Voronoi polygons
+        :param geo_filename: geometry file
+        :param area: (n, 2) vertices of the measurement area, see read_measurement_area
+        :param vmin: density of the lowest color
+        :param vmax: density of the highest color
+        """
+        self.data, self.vertices, self.offsets = read_IFD_polygons(IFD_filename)
+        self.frames = self.data['Frame'].to_numpy()
+        self.rhos = self.data['rho'].to_numpy()
+
+        geometry = load_geometry(geo_filename)
+        geominX, geomaxX, geominY, geomaxY = geometry.bounds()
+        obstacle_vertices, obstacle_offsets = geometry.obstacle_outlines()
+
+        self.fig, self.ax = plt.subplots()
+        ax = self.ax
+        ax.set_aspect('equal')
+        ax.add_collection(PolyCollection(
+            [obstacle_vertices[obstacle_offsets[k]:obstacle_offsets[k + 1]]
+             for k in range(len(obstacle_offsets) - 1)], color='gray'))
+        ax.add_collection(LineCollection(list(geometry.walls().values()), color='black', lw=2))
+
+        self.cells = PolyCollection([], cmap='rainbow', edgecolors='white', linewidths=1)
+        self.cells.set_clim(vmin, vmax)
+        self.cells.set_array(np.zeros(0))
+        ax.add_collection(self.cells)
+
+        if area is not None and len(area):
+            ax.plot(area[:, 0], area[:, 1], '-r')
+
+        ax.set_xlim(geominX, geomaxX)
+        ax.set_ylim(geominY, geomaxY)
+        ax.axis('off')
+
+        axins = inset_axes(ax,
+                       width="5.5%",  # width = 5% of parent_bbox width
+                       height="100%",  # height : 50%
+                       loc='lower left',
+                       bbox_to_anchor=(1, 0., 1, 1),
+                       bbox_transform=ax.transAxes,
+                       borderpad=0,
+                       )
+        self.fig.colorbar(self.cells, ax=ax, cax=axins)
+
+    def render(self, frame, figname):
+        rows = np.flatnonzero(self.frames == frame)
+        self.cells.set_verts([self.vertices[self.offsets[row]:self.offsets[row + 1]] for row in rows])
+        self.cells.set_array(self.rhos[rows])
+        self.ax.set_title("frame: {}".format(frame))
+        self.fig.savefig(figname)
+        return figname
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def IFD_plot_polygon_rho(IFD_filename, frame, geo_filename, area=None, figname=None, vmax=6):
     """Plot Voronoi polygons with measurement areas
 
-    :param Id:
-    :param frame:
-    :returns:
+    :param IFD_filename: IFD file (Method I) with Voronoi polygons
+    :param frame: frame to plot
+    :param geo_filename: geometry file
+    :param area: vertices of the measurement area, see read_measurement_area
+    :param figname: output file, default IFD_rho_<frame>.png
+    :returns: figname
     :rtype:
 
     """
+    if figname is None:
+        figname = "IFD_rho_{:05d}.png".format(frame)
+
+    renderer = PolygonFrameRenderer(IFD_filename, geo_filename, area, vmax=vmax)
+    try:
+        return renderer.render(frame, figname)
+    finally:
+        renderer.close()
+
+
+# Renderer of the current export worker process
+frame_renderer = None
 
-    m =  d.getElementsByTagName('measurement_areas')
-    verteces = []
-    for o_num, o_elem in enumerate(m[0].getElementsByTagName('area_B')):
-        if o_elem.getAttribute('id') == str(Id):
-            n_vertex = len(o_elem.getElementsByTagName('vertex'))
-            verteces = np.zeros((n_vertex, 2))
-
-            for v_num, v_elem in enumerate(o_elem.getElementsByTagName('vertex')):
-                    verteces[v_num, 0] = o_elem.getElementsByTagName('vertex')[v_num].attributes['x'].value
-                    verteces[v_num, 1] = o_elem.getElementsByTagName('vertex')[v_num].attributes['y'].value
-
-    xml_datei = open(geo_filename, "r")
-    geo_xml = parse(xml_datei)
-    xml_datei.close()
-
-    geometry_wall = read_subroom_walls(geo_xml)
-    geometry_obst = read_obstacle(geo_xml)
-
-    files = glob.glob(os.path.join(
-        jpsreport_ini_dir,
-        output_dir,
-        "Fundamental_Diagram",
-        "IndividualFD",
-        "*id_{}.dat".format(Id)))
-
-    df_poly = pd.read_csv(files[0],
-                          comment='#',sep='\t',
-                          names=['Frame','PersID','x','y','z','rho','vel','poly'],
-                          index_col=False)
-
-    # set the index to be this and don't drop
-    df_poly.set_index(keys=['Frame'], drop=False, inplace=True)
-
-    fig, ax = plt.subplots()
-    ax.set_aspect('equal')
-
-    for g in geometry_obst.keys():
-        ax.add_patch(ppolygon(geometry_obst[g], color='gray'))
-
-    for gw in geometry_wall.keys():
-        ax.plot(geometry_wall[gw][:, 0], geometry_wall[gw][:, 1], color='black', lw=2)
-
-    sm = cm.ScalarMappable(cmap = cm.get_cmap('rainbow'))
-
-    df_0 = df_poly[df_poly.Frame == frame]
-    polys = df_0['poly']
-    rhos = df_0['rho']
-    X = df_0['x']
-    Y = df_0['y']
-    sm.set_clim(vmin=0, vmax=6) # todo max rho
-    for x, y, rho, poly in zip(X, Y, rhos, polys):
-        p = str_to_array(poly)/10000
-        patch = ppolygon(p,
-                     fc= sm.to_rgba(rho),
-                     ec= 'white',
-                     lw=1)
-        ax.add_patch(patch)
-
-# plot measurement area
-    plt.plot(verteces[:, 0], verteces[:,1],'-r')
-
-    plt.axis('off')
-
-    axins = inset_axes(ax,
-                   width="5.5%",  # width = 5% of parent_bbox width
-                   height="100%",  # height : 50%
-                   loc='lower left',
-                   bbox_to_anchor=(1, 0., 1, 1),
-                   bbox_transform=ax.transAxes,
-                   borderpad=0,
-                   )
-    fig.colorbar(sm, ax=ax, cax=axins)
+
+def init_frame_renderer(*args):
+    global frame_renderer
+    frame_renderer = PolygonFrameRenderer(*args)
+
+
+def render_frame(job):
+    return frame_renderer.render(*job)
+
+
+def IFD_export_frames(IFD_filename, geo_filename, frames=None, area=None, out_dir=".",
+                      processes=None, animation=None, fps=8, vmax=6):
+    """Export the Voronoi cells of a frame range as images, rendered in a process pool
+
+    Every worker parses the IFD file and draws the static parts of the
+    figure once, then renders its share of the frames.
+
+    :param frames: frames to export, default all frames of the IFD file
+    :param out_dir: directory of the images IFD_rho_<frame>.png
+    :param processes: size of the worker pool, default os.cpu_count()
+    :param animation: optional file name of an animated GIF of all images
+    :param fps: frames per second of the animation
+    :returns: list of the image files
+    :rtype:
+
+    """
+    if frames is None:
+        frames = np.unique(read_IFD_polygons(IFD_filename)[0]['Frame'])
+
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(int(frame), os.path.join(out_dir, "IFD_rho_{:05d}.png".format(frame))) for frame in frames]
+    with Pool(processes, initializer=init_frame_renderer,
+              initargs=(IFD_filename, geo_filename, area, 0, vmax)) as pool:
+        fignames = pool.map(render_frame, jobs, chunksize=max(1, len(jobs) // (4 * (processes or os.cpu_count() or 1))))
+
+    if animation is not None and fignames:
+        # Only needed for the animation
+        from PIL import Image
+        images = [Image.open(f) for f in fignames]
+        images[0].save(animation, save_all=True, append_images=images[1:],
+                       duration=int(1000 / fps), loop=0)
+        print("--->", animation)
+
+    return fignames
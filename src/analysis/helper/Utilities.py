@@ -1,6 +1,8 @@
 import os
 import glob
 import re
+from multiprocessing import Pool
+from xml.etree import ElementTree as ET
 import numpy as np
 import pandas as pd
 
@@ -24,6 +26,70 @@ def str_to_array(p):
 
     return np.array(lst)
 
+# Translation of every character that is not part of a number (or a row
+# end) to a blank, str.translate is much faster than a regex substitution
+POLYGON_SEPARATORS = str.maketrans({chr(c): ' ' for c in range(128) if chr(c) not in '-.0123456789\n'})
+# Voronoi polygons are written in units of 1/10000 m
+POLYGON_SCALE = 10000
+
+# IFD_filename -> (mtime_ns, size, (data, vertices, offsets))
+IFD_polygons = {}
+
+
+def parse_polygons(polys, scale=POLYGON_SCALE):
+    """
+    convert a column of jpsreport polygons into one flat vertex array
+
+    All strings are parsed by a single np.fromstring call, the end of
+    every row is marked by a NaN.
+
+    :param polys: polygons (str), e.g. the 'poly' column of an IFD file
+    :param scale: the coordinates are divided by <scale>
+    :returns: vertices (n, 2), offsets: the polygon of row k is
+              vertices[offsets[k]:offsets[k + 1]]
+
+    """
+    polys = [str(p) for p in polys]
+    text = ('\n'.join(polys) + '\n').translate(POLYGON_SEPARATORS)
+    values = np.fromstring(text.replace('\n', ' nan '), sep=' ')
+    ends = np.isnan(values)
+    if np.count_nonzero(ends) != len(polys):
+        raise ValueError('could not convert polygons, malformed number')
+
+    rows = np.cumsum(ends)[~ends]
+    counts = np.bincount(rows, minlength=len(polys))
+    if np.any(counts % 2):
+        raise ValueError('polygon with an odd number of coordinates in row {}'.format(
+            np.flatnonzero(counts % 2)[0]))
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts // 2, out=offsets[1:])
+    return values[~ends].reshape(-1, 2) / scale, offsets
+
+
+def read_IFD_polygons(IFD_filename):
+    """ IFD data and its parsed Voronoi polygons
+
+    The result is kept until the file changes, so rendering several
+    frames of one file parses the polygons only once.
+
+    :returns: data (DataFrame without the 'poly' column), vertices, offsets
+              (see parse_polygons, rows in the order of data)
+    """
+    stat = os.stat(IFD_filename)
+    cached = IFD_polygons.get(IFD_filename)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    df = pd.read_csv(IFD_filename,
+                     comment='#',sep='\t',
+                     names=['Frame','PersID','x','y','z','rho','vel','poly'],
+                     index_col=False)
+    vertices, offsets = parse_polygons(df['poly'])
+    result = (df.drop(columns='poly'), vertices, offsets)
+    IFD_polygons[IFD_filename] = (stat.st_mtime_ns, stat.st_size, result)
+    return result
+
 def get_ids_nt_files(nt_files):
     """    extract ids from nt_files (Method A)
 
@@ -56,78 +122,108 @@ def get_ids_prf_files(field_dir):
     
 
 
-def read_obstacle(xml_doc):
-    # Initialization of a dictionary with obstacles
-    return_dict = {}
-    # read in obstacles and combine them into an array for polygon representation
-    for o_num, o_elem in enumerate(xml_doc.getElementsByTagName('obstacle')):
-
-        N_polygon = len(o_elem.getElementsByTagName('polygon'))
-        if len(o_elem.getElementsByTagName('polygon')) == 1:
-            pass
-        else:
-            points = np.zeros((0, 2))
-
-        for p_num, p_elem in enumerate(o_elem.getElementsByTagName('polygon')):
-            for v_num, v_elem in enumerate(p_elem.getElementsByTagName('vertex')):
-                vertex_x = float(p_elem.getElementsByTagName('vertex')[v_num].attributes['px'].value)
-                vertex_y = float(p_elem.getElementsByTagName('vertex')[v_num].attributes['py'].value)
-                points = np.vstack([points , [vertex_x, vertex_y]])
-
-        points = np.unique(points, axis=0)
-        x = points[:, 0]
-        y = points[:, 1]
-        n = len(points)
-        center_point = [np.sum(x)/n, np.sum(y)/n]
-        angles = np.arctan2(x-center_point[0],y-center_point[1])
-        ##sorting the points:
-        sort_tups = sorted([(i,j,k) for i,j,k in zip(x,y,angles)], key = lambda t: t[2])
-        return_dict[o_num] = np.array(sort_tups)[:,0:2]
-
-    return return_dict
-
-
-def read_subroom_walls(xml_doc):
-    dict_polynom_wall = {}
-    n_wall = 0
-    for s_num, s_elem in enumerate(xml_doc.getElementsByTagName('subroom')):
-        for p_num, p_elem in enumerate(s_elem.getElementsByTagName('polygon')):
-            if p_elem.getAttribute('caption') == "wall":
-                n_wall = n_wall + 1
-                n_vertex = len(p_elem.getElementsByTagName('vertex'))
-                vertex_array = np.zeros((n_vertex, 2))
-                
-                for v_num, v_elem in enumerate(p_elem.getElementsByTagName('vertex')):
-                    vertex_array[v_num, 0] = p_elem.getElementsByTagName('vertex')[v_num].attributes['px'].value
-                    vertex_array[v_num, 1] = p_elem.getElementsByTagName('vertex')[v_num].attributes['py'].value
-                
-                
-                dict_polynom_wall[n_wall] = vertex_array
-
-    return dict_polynom_wall
-
-
-def geo_limits(geo_xml):
-    geometry_wall = read_subroom_walls(geo_xml)
-    geominX=1000
-    geomaxX=-1000
-    geominY=1000
-    geomaxY=-1000
-    Xmin = []
-    Ymin = []
-    Xmax = []
-    Ymax = []
-    for k in geometry_wall.keys():
-        Xmin.append(np.min(geometry_wall[k][:,0]))
-        Ymin.append(np.min(geometry_wall[k][:,1]))  
-        Xmax.append(np.max(geometry_wall[k][:,0]))
-        Ymax.append(np.max(geometry_wall[k][:,1]))
-               
-    geominX = np.min(Xmin)
-    geomaxX = np.max(Xmax)
-    geominY = np.min(Ymin)
-    geomaxY = np.max(Ymax)
-    return geominX, geomaxX, geominY, geomaxY
+def get_prf_files(field_dir, quantity, Id):
+    """return profile files of a measurement area sorted by frame
+
+    :param field_dir: Fundamental_Diagram/Classical_Voronoi/field
+    :param quantity: "density" or "velocity"
+    :param Id: measurement area
+    :returns: frames (np.array), files
+    :rtype:
+
+    """
+    files = glob.glob(os.path.join(field_dir, quantity, "Prf_*id_{}_*.dat".format(Id)))
+    # Prf_d_*_id_%d_%.5d.dat, glob returns them in arbitrary order
+    frames = [int(f.split("_")[-1].split(".")[0]) for f in files]
+    order = np.argsort(frames, kind='stable')
+    return np.array(frames, dtype=np.int64)[order], [files[i] for i in order]
+
+
+def load_prf_stack(field_dir, quantity, Id, processes=None, cache_dir=None):
+    """ All profile files of a measurement area as one (frames, ny, nx) array
+
+    The files are parsed in a worker pool and written into a memory-mapped
+    stack, <cache_dir>/Prf_stack_id_<Id>.npy, that is reused as long as no
+    profile file is newer. Window means are then slice reductions, e.g.
+    stack[lo:hi].mean(axis=0).
+
+    :param processes: size of the worker pool, default os.cpu_count()
+    :param cache_dir: directory of the stack, default the profile directory
+                      <field_dir>/<quantity> of the JPSreport output
+    :returns: frames (np.array), stack (read-only np.memmap)
+    """
+    frames, files = get_prf_files(field_dir, quantity, Id)
+    if not files:
+        raise FileNotFoundError("no {} profiles of measurement area {} in {}".format(quantity, Id, field_dir))
+
+    if cache_dir is None:
+        cache_dir = os.path.join(field_dir, quantity)
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+    stack_file = os.path.join(cache_dir, "Prf_stack_id_{}.npy".format(Id))
+    if os.path.exists(stack_file) and \
+            os.path.getmtime(stack_file) >= max(os.path.getmtime(f) for f in files):
+        stack = np.load(stack_file, mmap_mode='r')
+        if len(stack) == len(files):
+            return frames, stack
+
+    shape = np.loadtxt(files[0]).shape
+    tmp_file = "{}.tmp{}.npy".format(stack_file[:-len(".npy")], os.getpid())
+    stack = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.float64,
+                                      shape=(len(files),) + shape)
+    with Pool(processes) as pool:
+        # imap keeps the file order, every matrix goes to its frame slot
+        for k, matrix in enumerate(pool.imap(np.loadtxt, files, chunksize=16)):
+            stack[k] = matrix
+    stack.flush()
+    del stack
+    os.replace(tmp_file, stack_file)
+    return frames, np.load(stack_file, mmap_mode='r')
+
+
+def prf_window_mean(frames, stack, beginsteady=None, endsteady=None):
+    """ Mean profile of the frames within [beginsteady, endsteady]
+
+    :param beginsteady: From frame. If None, then take first frame
+    :param endsteady: End frame. If None, then take last frame
+    """
+    lo = 0 if beginsteady is None else np.searchsorted(frames, beginsteady, side='left')
+    hi = len(frames) if endsteady is None else np.searchsorted(frames, endsteady, side='right')
+    if lo >= hi:
+        return np.zeros(stack.shape[1:])
+    return np.mean(stack[lo:hi], axis=0)
+
+
+def read_measurement_area(jpsreport_inifile, Id):
+    """ vertices of the measurement area <Id> (area_B) of a jpsreport inifile
+
+    :returns: (n, 2) array, empty if the inifile has no such area
+    """
+    for area in ET.parse(jpsreport_inifile).iter('area_B'):
+        if area.get('id') == str(Id):
+            return np.array([[float(v.get('x')), float(v.get('y'))] for v in area.iter('vertex')]).reshape(-1, 2)
+    return np.zeros((0, 2))
+
+
+def measurement_area_rows(grid, jpsreport_inifile, Id, beginsteady=None, endsteady=None):
+    """ Rows of a trajectory inside the measurement area <Id> of a jpsreport inifile
+
+    :param grid: analysis.spatial.FrameGrid of the trajectory columns
+    :param beginsteady: From frame. If None, then take first frame
+    :param endsteady: End frame. If None, then take last frame
+    :returns: row indices ordered by frame
+    """
+    return grid.in_polygon(read_measurement_area(jpsreport_inifile, Id), beginsteady, endsteady)
+
+
+def read_obstacle(geometry):
+    """ Obstacle outlines of a geometry.Geometry as {obstacle number: (n, 2) array}
+
+    The arrays are views into the ragged array of Geometry.obstacle_outlines
+    """
+    vertices, offsets = geometry.obstacle_outlines()
+    return {o_num: vertices[offsets[o_num]:offsets[o_num + 1]] for o_num in range(len(offsets) - 1)}
+
 
 def plot_peds(ax):
     for i in ids:
@@ -1,30 +1,26 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
 
-def get_frame_limits(IFDfile):
-    data = pd.read_csv(IFDfile,comment='#',sep='\t',
-                       names=['Frame','PersID','x','y','z','rho','vel','poly'],
-                       index_col=False)
+def read_rho_v(rho_v_filename, data=None):
+    """ rho_v data and its first and last frame
 
-    frames = data['Frame']
-    m = np.min(frames)
-    M = np.max(frames)
-    return m, M
+    :param rho_v_filename: rho_v file, only read if <data> is None
+    :param data: already parsed rho_v array (e.g. from the ingestion cache)
+    :returns: data, fmin, fmax
+    """
+    if data is None:
+        data = np.loadtxt(rho_v_filename)
+    frames = data[:, 0]
+    return data, int(np.min(frames)), int(np.max(frames))
 
 
-def plot_density_frame(rho_v_filename):
+def plot_density_frame(rho_v_filename, data=None, figname="density_frame.png"):
     print('------- Start generate Rho_frame --------')
-    fmin = get_frame_limits(rho_v_filename)[0]
-    fmax = get_frame_limits(rho_v_filename)[1]
-
-    f = rho_v_filename
-    figname = "density_frame.png"
+    data, fmin, fmax = read_rho_v(rho_v_filename, data)
 
     fig1, axs = plt.subplots(1, 1)
 
-    data = np.loadtxt(f)
     mask = (data[:, 0] >= fmin) & (data[:, 0] <= fmax)
     frames = data[:, 0]
 
@@ -42,17 +38,12 @@ def plot_density_frame(rho_v_filename):
     print ("------- Plot Rho_frame finished! --------")
 
 
-def plot_velocity_frame(rho_v_filename):
+def plot_velocity_frame(rho_v_filename, data=None, figname="velocity_frame.png"):
     print('------- Start generate V_frame --------')
-    fmin = get_frame_limits(rho_v_filename)[0]
-    fmax = get_frame_limits(rho_v_filename)[1]
-
-    f = rho_v_filename
-    figname = "velocity_frame.png"
+    data, fmin, fmax = read_rho_v(rho_v_filename, data)
 
     fig1, axs = plt.subplots(1, 1)
 
-    data = np.loadtxt(f)
     mask = (data[:, 0] >= fmin) & (data[:, 0] <= fmax)
     frames = data[:, 0]
 
@@ -70,17 +61,12 @@ def plot_velocity_frame(rho_v_filename):
     print ("------- Plot V_frame finished! --------")
 
 
-def plot_density_J(rho_v_filename):
+def plot_density_J(rho_v_filename, data=None, figname="density_J.png"):
     print('------- Start generate Rho_J --------')
-    fmin = get_frame_limits(rho_v_filename)[0]
-    fmax = get_frame_limits(rho_v_filename)[1]
-
-    f = rho_v_filename
-    figname = "density_J.png"
+    data, fmin, fmax = read_rho_v(rho_v_filename, data)
 
     fig1, axs = plt.subplots(1, 1)
 
-    data = np.loadtxt(f)
     mask = (data[:, 0] >= fmin) & (data[:, 0] <= fmax)
 
     # rho vs J
@@ -97,17 +83,12 @@ def plot_density_J(rho_v_filename):
     print ("------- Plot Rho_J finished! --------")
 
 
-def plot_density_velocity(rho_v_filename):
+def plot_density_velocity(rho_v_filename, data=None, figname="density_velocity.png"):
     print('------- Start generate Rho_V --------')
-    fmin = get_frame_limits(rho_v_filename)[0]
-    fmax = get_frame_limits(rho_v_filename)[1]
-
-    f = rho_v_filename
-    figname = "density_velocity.png"
+    data, fmin, fmax = read_rho_v(rho_v_filename, data)
 
     fig1, axs = plt.subplots(1, 1)
 
-    data = np.loadtxt(f)
     mask = (data[:, 0] >= fmin) & (data[:, 0] <= fmax)
 
     data2 = data[mask]
@@ -122,3 +103,10 @@ def plot_density_velocity(rho_v_filename):
     fig1.savefig(figname, dpi=300)
     print ("------- Plot Rho_V finished! --------")
 
+
+FD_PLOTS = {
+    'density_frame': plot_density_frame,
+    'velocity_frame': plot_velocity_frame,
+    'density_J': plot_density_J,
+    'density_velocity': plot_density_velocity,
+}
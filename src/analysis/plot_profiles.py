@@ -4,15 +4,16 @@
 import sys
 import time
 import os
-from scipy import stats
+import json
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-from xml.dom.minidom import parse
 import pandas as pd
 import glob
 
+from analysis import geometry
+
 
 def plot_geometry(ax, _geometry_wall):
     for gw in _geometry_wall.keys():
@@ -27,50 +28,194 @@ def read_IFD(IFD_filename):
     return df
 
 
-def geo_limits(geo_xml):
-    geometry_wall = read_subroom_walls(geo_xml)
-    geominX=1000
-    geomaxX=-1000
-    geominY=1000
-    geomaxY=-1000
-    Xmin = []
-    Ymin = []
-    Xmax = []
-    Ymax = []
-    for k in geometry_wall.keys():
-        Xmin.append(np.min(geometry_wall[k][:,0]))
-        Ymin.append(np.min(geometry_wall[k][:,1]))
-        Xmax.append(np.max(geometry_wall[k][:,0]))
-        Ymax.append(np.max(geometry_wall[k][:,1]))
+# Per-cell sums collected by profile_sums, in this order
+SUM_FIELDS = ['count', 'd', 'v', 'dv', 'dd', 'vv']
+# Default grid cell size (dx, dy) of the profiles in m
+DEFAULT_GRID_SIZE = 0.2
+# Memory budget of the prefix sums of a ProfileIndex
+PROFILE_INDEX_BYTES = 256 * 1024 * 1024
+# Largest profile grid, finer grids of large geometries would not fit into memory
+MAX_PROFILE_CELLS = 1000000
 
-    geominX = np.min(Xmin)
-    geomaxX = np.max(Xmax)
-    geominY = np.min(Ymin)
-    geomaxY = np.max(Ymax)
-    return geominX, geomaxX, geominY, geomaxY
 
+def bin_indices(x, y, xbins, ybins):
+    """ Flat grid cell (iy * nx + ix) of every point, -1 for points outside the grid
 
-def read_subroom_walls(xml_doc):
-    dict_polynom_wall = {}
-    n_wall = 0
-    for s_num, s_elem in enumerate(xml_doc.getElementsByTagName('subroom')):
-        for p_num, p_elem in enumerate(s_elem.getElementsByTagName('polygon')):
-            if p_elem.getAttribute('caption') == "wall":
-                n_wall = n_wall + 1
-                n_vertex = len(p_elem.getElementsByTagName('vertex'))
-                vertex_array = np.zeros((n_vertex, 2))
+    Bins are half open like in scipy.stats.binned_statistic_2d, except
+    the last one, which includes its right edge.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    nx, ny = len(xbins) - 1, len(ybins) - 1
+    ix = np.searchsorted(xbins, x, side='right') - 1
+    iy = np.searchsorted(ybins, y, side='right') - 1
+    ix[x == xbins[-1]] = nx - 1
+    iy[y == ybins[-1]] = ny - 1
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    return np.where(inside, iy * nx + ix, -1)
+
+
+def profile_sums(x, y, d, v, xbins, ybins):
+    """ Bin the points once and sum every field of SUM_FIELDS per grid cell
+
+    :param x, y: positions
+    :param d, v: individual density and velocity
+    :returns: array of shape (len(SUM_FIELDS), ny, nx)
+    """
+    cells = bin_indices(x, y, xbins, ybins)
+    inside = cells >= 0
+    cells = cells[inside]
+    d = np.asarray(d, dtype=float)[inside]
+    v = np.asarray(v, dtype=float)[inside]
 
-                for v_num, v_elem in enumerate(p_elem.getElementsByTagName('vertex')):
-                    vertex_array[v_num, 0] = p_elem.getElementsByTagName('vertex')[v_num].attributes['px'].value
-                    vertex_array[v_num, 1] = p_elem.getElementsByTagName('vertex')[v_num].attributes['py'].value
+    nx, ny = len(xbins) - 1, len(ybins) - 1
+    sums = np.empty((len(SUM_FIELDS), ny * nx))
+    for k, weights in enumerate([None, d, v, d * v, d * d, v * v]):
+        sums[k] = np.bincount(cells, weights=weights, minlength=ny * nx)
+    return sums.reshape(len(SUM_FIELDS), ny, nx)
 
 
-                dict_polynom_wall[n_wall] = vertex_array
+def profile_statistics(sums):
+    """ Profiles of every grid cell from the sums of profile_sums
 
-    return dict_polynom_wall
+    Empty cells are 0, like the nan_to_num'ed binned_statistic_2d means.
 
+    :returns: dictionary of (ny, nx) arrays: count, density, velocity,
+              flow (mean of rho*v), density_std, velocity_std and the
+              scalar mean_velocity over all binned points
+    """
+    count, d, v, dv, dd, vv = sums
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = {name: np.nan_to_num(s / count) for name, s in [('d', d), ('v', v), ('dv', dv), ('dd', dd), ('vv', vv)]}
+    total = np.sum(count)
+
+    return {
+        'count': count,
+        'density': mean['d'],
+        'velocity': mean['v'],
+        'flow': mean['dv'],
+        'density_std': np.sqrt(np.maximum(mean['dd'] - mean['d'] ** 2, 0)),
+        'velocity_std': np.sqrt(np.maximum(mean['vv'] - mean['v'] ** 2, 0)),
+        'mean_velocity': np.sum(v) / total if total else 0.0,
+    }
+
+
+class ProfileIndex:
+    """ Prefix sums of profile_sums over blocks of frames
+
+    prefix[k] holds the sums of all frames before first_frame + k * block_size,
+    so the sums of any frame window are the difference of two entries plus
+    the rows of at most two partially covered blocks. Answering a window
+    costs O(grid cells + rows of two blocks) instead of re-binning all rows.
+    """
 
-def get_profile(data, xbins, ybins, geometry_wall):
+    def __init__(self, data, xbins, ybins, prefix, first_frame, block_size, order, frames):
+        self.x = np.asarray(data['x'])
+        self.y = np.asarray(data['y'])
+        self.d = np.asarray(data['d'])
+        self.v = np.asarray(data['v'])
+        self.xbins = xbins
+        self.ybins = ybins
+        self.prefix = prefix
+        self.first_frame = first_frame
+        self.block_size = block_size
+        # rows of <data> sorted by frame, and their frames
+        self.order = order
+        self.frames = frames
+
+    @classmethod
+    def build(cls, data, xbins, ybins, block_size=None):
+        """ Bin every row of <data> once and accumulate the sums block by block
+
+        :param block_size: frames per block, by default the smallest size
+                           keeping the prefix sums within PROFILE_INDEX_BYTES
+        """
+        f = np.asarray(data['f'])
+        order = np.argsort(f, kind='stable')
+        frames = f[order]
+        nx, ny = len(xbins) - 1, len(ybins) - 1
+        if len(frames) == 0:
+            return cls(data, xbins, ybins, np.zeros((1, len(SUM_FIELDS), ny, nx)), 0, 1, order, frames)
+
+        first_frame = int(frames[0])
+        n_frames = int(frames[-1]) - first_frame + 1
+        if block_size is None:
+            block_bytes = len(SUM_FIELDS) * nx * ny * 8
+            block_size = max(1, int(np.ceil(n_frames * block_bytes / PROFILE_INDEX_BYTES)))
+        n_blocks = (n_frames + block_size - 1) // block_size
+
+        # One bincount over (block, cell) pairs per summed field
+        cells = bin_indices(np.asarray(data['x'])[order], np.asarray(data['y'])[order], xbins, ybins)
+        inside = cells >= 0
+        blocks = (frames[inside] - first_frame) // block_size
+        pairs = blocks * (nx * ny) + cells[inside]
+        d = np.asarray(data['d'], dtype=float)[order][inside]
+        v = np.asarray(data['v'], dtype=float)[order][inside]
+
+        prefix = np.zeros((n_blocks + 1, len(SUM_FIELDS), ny * nx))
+        for k, weights in enumerate([None, d, v, d * v, d * d, v * v]):
+            block_sums = np.bincount(pairs, weights=weights, minlength=n_blocks * nx * ny)
+            np.cumsum(block_sums.reshape(n_blocks, nx * ny), axis=0, out=prefix[1:, k])
+        prefix = prefix.reshape(n_blocks + 1, len(SUM_FIELDS), ny, nx)
+
+        return cls(data, xbins, ybins, prefix, first_frame, block_size, order, frames)
+
+    def save(self, directory):
+        np.save(os.path.join(directory, 'prefix.npy'), self.prefix)
+        np.save(os.path.join(directory, 'order.npy'), self.order)
+        np.save(os.path.join(directory, 'frames.npy'), self.frames)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'first_frame': self.first_frame, 'block_size': self.block_size}, f)
+
+    @classmethod
+    def load(cls, directory, data, xbins, ybins):
+        """ Open an index stored by save() for the same <data> and grid """
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+                  for name in ['prefix', 'order', 'frames']]
+        return cls(data, xbins, ybins, arrays[0], meta['first_frame'], meta['block_size'], *arrays[1:])
+
+    def frame_limits(self, beginFrame=None, endFrame=None):
+        """ Window clamped to the frames of the data """
+        if len(self.frames) == 0:
+            return 0, -1
+        first, last = int(self.frames[0]), int(self.frames[-1])
+        beginFrame = first if beginFrame is None else max(int(beginFrame), first)
+        endFrame = last if endFrame is None else min(int(endFrame), last)
+        return beginFrame, endFrame
+
+    def row_sums(self, beginFrame, endFrame):
+        """ profile_sums of the rows with beginFrame <= frame <= endFrame """
+        lo = np.searchsorted(self.frames, beginFrame, side='left')
+        hi = np.searchsorted(self.frames, endFrame, side='right')
+        rows = self.order[lo:hi]
+        return profile_sums(self.x[rows], self.y[rows], self.d[rows], self.v[rows], self.xbins, self.ybins)
+
+    def sums(self, beginFrame, endFrame):
+        """ profile_sums of the frame window [beginFrame, endFrame] """
+        beginFrame, endFrame = self.frame_limits(beginFrame, endFrame)
+        if beginFrame > endFrame:
+            return np.zeros(self.prefix.shape[1:])
+
+        # Blocks completely inside the window, [b0, b1)
+        b0 = -(-(beginFrame - self.first_frame) // self.block_size)
+        b1 = (endFrame + 1 - self.first_frame) // self.block_size
+        if b0 >= b1:
+            return self.row_sums(beginFrame, endFrame)
+
+        sums = self.prefix[b1] - self.prefix[b0]
+        block_begin = self.first_frame + b0 * self.block_size
+        block_end = self.first_frame + b1 * self.block_size
+        if beginFrame < block_begin:
+            sums += self.row_sums(beginFrame, block_begin - 1)
+        if endFrame >= block_end:
+            sums += self.row_sums(block_end, endFrame)
+        return sums
+
+
+def get_profile(data, xbins, ybins, geometry_wall, limits, frames,
+                figname1="profile_density.png", figname2="profile_velocity.png"):
     """ make profile plots for density and velocity
     This method, discritises the geometry in regular grids.
     The value of every grid cell is the mean of <values> for points within each bin.
@@ -80,19 +225,27 @@ def get_profile(data, xbins, ybins, geometry_wall):
     :param data: pandas array containing IFD-Date (calculated by method I)
     :param xbins: Discretisation of the geometry in x-axis
     :param ybins: Discretisation of the geometry in y-axis
-    :param Id: A number. Useful to produce movies
     :param geometry_wall: Geometry
+    :param limits: geominX, geomaxX, geominY, geomaxY of the geometry
+    :param frames: first and last frame of <data>, shown in the title
+    :param figname1: output file of the density profile
+    :param figname2: output file of the velocity profile
     :returns: plots two figures: Density and Velocity profiles
     :rtype:
 
     """
-    # t = time.process_time()
-    ret1 = stats.binned_statistic_2d(data['x'], data['y'], data['d'], 'mean', bins=[xbins, ybins])
-    ret2 = stats.binned_statistic_2d(data['x'], data['y'], data['v'], 'mean', bins=[xbins, ybins])
+    profiles = profile_statistics(profile_sums(data['x'], data['y'], data['d'], data['v'], xbins, ybins))
+    return plot_profile_figures(profiles, xbins, ybins, geometry_wall, limits, frames, figname1, figname2)
+
 
-    prof1 = np.nan_to_num(ret1.statistic.T)
-    prof2 = np.nan_to_num(ret2.statistic.T)
-    ids = np.unique(data['i'])
+def plot_profile_figures(profiles, xbins, ybins, geometry_wall, limits, frames,
+                         figname1="profile_density.png", figname2="profile_velocity.png"):
+    """ plot the density and velocity of profile_statistics as two figures """
+    prof1 = profiles['density']
+    prof2 = profiles['velocity']
+    mean_velocity = profiles['mean_velocity']
+    dx = xbins[1] - xbins[0]
+    dy = ybins[1] - ybins[0]
 
     methods = ['none', 'nearest', 'bilinear', 'bicubic', 'spline16',
            'spline36', 'hanning', 'hamming', 'hermite', 'kaiser', 'quadric',
@@ -107,23 +260,21 @@ def get_profile(data, xbins, ybins, geometry_wall):
                         interpolation=m,
                         origin='lower',
                         vmin=0, vmax=5.5,#np.mean(data['d']) + np.mean(data['d']),
-                        extent=[geominX, geomaxX, geominY, geomaxY])
+                        extent=limits)
 
         im2 = ax2.imshow(prof2,
                         cmap=cm.jet,
                         interpolation=m,
                         origin='lower',
-                        vmin=0, vmax=np.mean(data['v']) + np.mean(data['v']),
-                        extent=[geominX, geomaxX, geominY, geomaxY])
+                        vmin=0, vmax=mean_velocity + mean_velocity,
+                        extent=limits)
 
 
         plot_geometry(ax1, geometry_wall)
         plot_geometry(ax2, geometry_wall)
         # plot_peds(ax)
-        ax1.set_title("fr: [{}-{}], dx={:.2f}, dy={:.2f}".format(beginFrame, endFrame, dx, dy))
-        ax2.set_title("fr: [{}-{}], dx={:.2f}, dy={:.2f}".format(beginFrame, endFrame, dx, dy))
-        figname1 = "profile_density.png"
-        figname2 = "profile_velocity.png"
+        ax1.set_title("fr: [{}-{}], dx={:.2f}, dy={:.2f}".format(frames[0], frames[1], dx, dy))
+        ax2.set_title("fr: [{}-{}], dx={:.2f}, dy={:.2f}".format(frames[0], frames[1], dx, dy))
         # print(figname1)
         # print(figname2)
         divider1 = make_axes_locatable(ax1)
@@ -142,34 +293,38 @@ def get_profile(data, xbins, ybins, geometry_wall):
     return np.mean(prof1), np.std(prof1), np.max(prof1), np.min(prof1)
 
 
-def get_frame_limits(IFDfile):
-    # data = np.loadtxt(IFDfile)
-    # frames = data[:, 0]
-    # m = np.min(frames)
-    # M = np.max(frames)
-    data = pd.read_csv(IFDfile,comment='#',sep='\t',
-                       names=['Frame','PersID','x','y','z','rho','vel','poly'],
-                       index_col=False)
+def grid_cells(limits, dx, dy):
+    """ Number of profile grid cells over [geominX, geomaxX, geominY, geomaxY] """
+    geominX, geomaxX, geominY, geomaxY = limits
+    return int(np.ceil((geomaxX - geominX) / dx)) * int(np.ceil((geomaxY - geominY) / dy))
 
-    frames = data['Frame']
-    m = np.min(frames)
-    M = np.max(frames)
-    return m, M
 
+def profile_grid(geo_filename, dx=DEFAULT_GRID_SIZE, dy=DEFAULT_GRID_SIZE, geo=None):
+    """ Walls, limits and bin edges of the profile grid over a geometry
 
-def plot_profiles(geo_filename, traj_filename, IFD_filename):
+    :param geo: already parsed geometry.Geometry, else <geo_filename> is loaded
+    :returns: geometry_wall, [geominX, geomaxX, geominY, geomaxY], xbins, ybins
+    :raises ValueError: for grids of more than MAX_PROFILE_CELLS cells
+    """
+    if geo is None:
+        geo = geometry.load_geometry(geo_filename)
+    geometry_wall = geo.walls()
+
+    geominX, geomaxX, geominY, geomaxY = geo.bounds()
+    if grid_cells([geominX, geomaxX, geominY, geomaxY], dx, dy) > MAX_PROFILE_CELLS:
+        raise ValueError('the profile grid has more than {} cells, use a larger dx or dy'.format(MAX_PROFILE_CELLS))
+    xbins = np.arange(geominX, geomaxX + dx, dx)
+    ybins = np.arange(geominY, geomaxY + dy, dy)
+    return geometry_wall, [geominX, geomaxX, geominY, geomaxY], xbins, ybins
+
+
+def plot_profiles(geo_filename, traj_filename, IFD_filename,
+                  density_figname="profile_density.png", velocity_figname="profile_velocity.png",
+                  beginFrame=None, endFrame=None, dx=DEFAULT_GRID_SIZE, dy=DEFAULT_GRID_SIZE):
     print('------- Start generate profiles --------')
-    global beginFrame
-    global endFrame
-    beginFrame = get_frame_limits(IFD_filename)[0]
-    endFrame = get_frame_limits(IFD_filename)[1]
 
     # dx = args.size
     # dy = args.size # probably should be parsed as well, but here dx == dy
-    global dx
-    global dy
-    dx = 0.2
-    dy = 0.2
     #---
     # print("inifile: {}".format(jpsreport_inifile))
     # print("Begin steady: {}".format(beginFrame))
@@ -208,32 +363,22 @@ def plot_profiles(geo_filename, traj_filename, IFD_filename):
     # else:
         # print("traj: {}".format(IFD_filename))
 
-    xml_datei = open(geo_filename, "r")
-    geo_xml = parse(xml_datei)
-    xml_datei.close()
-    geometry_wall = read_subroom_walls(geo_xml)
-
-    global geominX
-    global geomaxX
-    global geominY
-    global geomaxY
-    geominX, geomaxX, geominY, geomaxY = geo_limits(geo_xml)
+    geometry_wall, limits, xbins, ybins = profile_grid(geo_filename, dx, dy)
 
     data = read_IFD(IFD_filename)
     # filter data
-    if beginFrame is None or beginFrame < data['f'].iloc[0]:
-        beginFrame = data['f'].iloc[0]
+    if beginFrame is None or beginFrame < np.min(data['f']):
+        beginFrame = np.min(data['f'])
         # print("Change begin frame to {}".format(beginFrame))
-    if endFrame is None or endFrame > data['f'].iloc[-1]:
+    if endFrame is None or endFrame > np.max(data['f']):
         # print("Change end frame to {}".format(endFrame))
-        endFrame = data['f'].iloc[-1]
+        endFrame = np.max(data['f'])
 
     ###################################################
 
-    xbins = np.arange(geominX, geomaxX + dx, dx)
-    ybins = np.arange(geominY, geomaxY + dx, dy)
     data = data[(data['f'] >= beginFrame) & (data['f'] <= endFrame)]
-    get_profile(data, xbins, ybins, geometry_wall)
+    get_profile(data, xbins, ybins, geometry_wall, limits, [beginFrame, endFrame],
+                density_figname, velocity_figname)
     ###################################################
     print ("------- Plot profiles finished! --------")
 
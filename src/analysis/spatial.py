@@ -0,0 +1,193 @@
+#  \file spatial.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+
+# Spatial index over the positions of a trajectory.
+#
+# Every row (pedestrian position in a frame) is assigned to a cell of a
+# uniform grid, and the rows are sorted by (frame, cell row, cell). The
+# rows of a frame range within a range of cells are then a few contiguous
+# slices found by binary search, so region and neighbour queries only
+# touch the rows near the query. The index works on plain column arrays
+# and serves the /query endpoints as well as analysis scripts, e.g.
+# selecting the rows inside a measurement area.
+import os
+
+import numpy as np
+
+# Edge length of a grid cell in metres, about the distance between neighbours
+CELL_SIZE = 1.0
+
+# Arrays of the index, persisted as <name>.npy by FrameGrid.save
+ARRAYS = ['frames', 'order', 'keys', 'grid']
+
+
+def concatenate_ranges(starts, stops):
+    """ Concatenation of np.arange(starts[k], stops[k]) for all k """
+    lengths = np.maximum(stops - starts, 0)
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+
+
+def points_in_polygon(x, y, polygon):
+    """ Even-odd rule test of the points (x, y) against a polygon
+
+    :param polygon: (n, 2) vertices, the last one is connected to the first
+    :returns: boolean array
+    """
+    inside = np.zeros(len(x), dtype=bool)
+    x0, y0 = polygon[-1]
+    for x1, y1 in polygon:
+        # Edges crossing the horizontal line through the point, left of it
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            at = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (x < at)
+        x0, y0 = x1, y1
+    return inside
+
+
+class FrameGrid:
+    """ Uniform grid index of the positions of every frame
+
+    frames are the sorted frame numbers, the rows sorted by key are
+    order, with keys = (frame position * ny + cell y) * nx + cell x.
+    grid holds x0, y0, cell size, nx, ny.
+
+    :param frame, x, y: columns of the indexed rows (e.g. trajectory columns)
+    """
+
+    def __init__(self, frame, x, y, frames, order, keys, grid):
+        self.frame = frame
+        self.x = x
+        self.y = y
+        self.frames = frames
+        self.order = order
+        self.keys = keys
+        self.grid = grid
+        self.x0, self.y0, self.cell_size = float(grid[0]), float(grid[1]), float(grid[2])
+        self.nx, self.ny = int(grid[3]), int(grid[4])
+
+    @classmethod
+    def build(cls, frame, x, y, cell_size=CELL_SIZE):
+        frames = np.unique(frame)
+        if len(frame):
+            x0, y0 = float(np.min(x)), float(np.min(y))
+            nx = int((np.max(x) - x0) // cell_size) + 1
+            ny = int((np.max(y) - y0) // cell_size) + 1
+        else:
+            x0, y0, nx, ny = 0.0, 0.0, 1, 1
+        grid = np.array([x0, y0, cell_size, nx, ny], dtype=np.float64)
+
+        index = cls(frame, x, y, frames, None, None, grid)
+        cx, cy = index.cells(x, y)
+        keys = (np.searchsorted(frames, frame).astype(np.int64) * ny + cy) * nx + cx
+        index.order = np.argsort(keys, kind='stable')
+        index.keys = keys[index.order]
+        return index
+
+    def save(self, directory):
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, frame, x, y):
+        arrays = [np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in ARRAYS]
+        return cls(frame, x, y, *arrays)
+
+    def cells(self, x, y):
+        """ Cell coordinates of points, clipped to the grid """
+        cx = np.clip(np.floor((np.asarray(x) - self.x0) / self.cell_size), 0, self.nx - 1).astype(np.int64)
+        cy = np.clip(np.floor((np.asarray(y) - self.y0) / self.cell_size), 0, self.ny - 1).astype(np.int64)
+        return cx, cy
+
+    def frame_positions(self, first=None, last=None):
+        """ Positions in self.frames of the frames within [first, last], None for open ends """
+        lo = 0 if first is None else np.searchsorted(self.frames, first, side='left')
+        hi = len(self.frames) if last is None else np.searchsorted(self.frames, last, side='right')
+        return np.arange(lo, max(lo, hi))
+
+    def cell_rows(self, positions, cx0, cx1, cy0, cy1):
+        """ Rows of the frames at <positions> in the cells [cx0, cx1] x [cy0, cy1] """
+        cy = np.arange(cy0, cy1 + 1)
+        base = ((positions[:, None].astype(np.int64) * self.ny + cy[None, :]) * self.nx).ravel()
+        starts = np.searchsorted(self.keys, base + cx0, side='left')
+        stops = np.searchsorted(self.keys, base + cx1, side='right')
+        return self.order[concatenate_ranges(starts, stops)]
+
+    def in_rectangle(self, xmin, xmax, ymin, ymax, first=None, last=None):
+        """ Rows inside [xmin, xmax] x [ymin, ymax] in the frames within [first, last]
+
+        :returns: row indices ordered by frame
+        """
+        positions = self.frame_positions(first, last)
+        if xmin > xmax or ymin > ymax or len(positions) == 0:
+            return np.zeros(0, dtype=np.int64)
+        (cx0, cx1), (cy0, cy1) = self.cells([xmin, xmax], [ymin, ymax])
+        rows = self.cell_rows(positions, cx0, cx1, cy0, cy1)
+        x, y = self.x[rows], self.y[rows]
+        return rows[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)]
+
+    def in_polygon(self, polygon, first=None, last=None):
+        """ Rows inside a polygon (e.g. a measurement area) in the frames within [first, last]
+
+        :param polygon: (n, 2) vertices
+        :returns: row indices ordered by frame
+        """
+        polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if len(polygon) < 3:
+            return np.zeros(0, dtype=np.int64)
+        rows = self.in_rectangle(polygon[:, 0].min(), polygon[:, 0].max(),
+                                 polygon[:, 1].min(), polygon[:, 1].max(), first, last)
+        return rows[points_in_polygon(self.x[rows], self.y[rows], polygon)]
+
+    def nearest(self, frame, x, y, k, exclude=None):
+        """ The <k> rows of <frame> closest to (x, y)
+
+        Rings of cells around the point are searched until the k-th
+        distance found is smaller than the distance to the unsearched cells.
+
+        :param exclude: row to leave out, e.g. the pedestrian at (x, y)
+        :returns: (rows, distances) sorted by distance
+        """
+        positions = self.frame_positions(frame, frame)
+        if len(positions) == 0 or k < 1:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        (cx,), (cy,) = self.cells([x], [y])
+
+        radius = 0
+        while True:
+            cx0, cx1 = max(cx - radius, 0), min(cx + radius, self.nx - 1)
+            cy0, cy1 = max(cy - radius, 0), min(cy + radius, self.ny - 1)
+            rows = self.cell_rows(positions, cx0, cx1, cy0, cy1)
+            if exclude is not None:
+                rows = rows[rows != exclude]
+            distances = np.hypot(self.x[rows] - x, self.y[rows] - y)
+            complete = cx0 == 0 and cy0 == 0 and cx1 == self.nx - 1 and cy1 == self.ny - 1
+            if len(rows) >= k or complete:
+                nearest = np.argsort(distances, kind='stable')[:k]
+                # Distance from the point to the cells outside of the searched
+                # ones, the border cells of the grid extend to infinity
+                reach = min(x - (self.x0 + cx0 * self.cell_size) if cx0 > 0 else np.inf,
+                            self.x0 + (cx1 + 1) * self.cell_size - x if cx1 < self.nx - 1 else np.inf,
+                            y - (self.y0 + cy0 * self.cell_size) if cy0 > 0 else np.inf,
+                            self.y0 + (cy1 + 1) * self.cell_size - y if cy1 < self.ny - 1 else np.inf)
+                if complete or distances[nearest[-1]] <= reach:
+                    return rows[nearest], distances[nearest]
+            radius += 1
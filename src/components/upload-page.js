@@ -71,8 +71,13 @@ class UploadPage extends React.Component {
     super(props)
     this.state = {
       current: 0,
+      // Dataset of the uploaded files, named by the server on the first upload
+      dataset: null,
       selectedFile: null
     }
+    // Uploads one after the other, later ones go to the dataset of the first
+    this.uploads = Promise.resolve()
+    this.dataset = null
   }
 
   /* Event handlers */
@@ -89,18 +94,26 @@ class UploadPage extends React.Component {
     const data = new FormData()
     const { onSuccess, onError, file } = options
 
-    data.append('file', this.state.selectedFile)
-
-    axios
-      .post('http://localhost:8080/upload', data, {})
-      .then(res => {
-        onSuccess(file)
-        console.log(res)
-      })
-      .catch(err => {
-        const error = new Error('Some error')
-        onError({ event: error })
-      })
+    data.append('file', file)
+
+    this.uploads = this.uploads.then(() => {
+      // this.state may not be updated yet when the next upload starts
+      const dataset = this.dataset ? `?dataset=${this.dataset}` : ''
+      return axios
+        .post(`http://localhost:8080/upload${dataset}`, data, {})
+        .then(res => {
+          if (res.data.dataset) {
+            this.dataset = res.data.dataset
+            this.setState({ dataset: res.data.dataset })
+          }
+          onSuccess(file)
+          console.log(res)
+        })
+        .catch(err => {
+          const error = new Error('Some error')
+          onError({ event: error })
+        })
+    })
   }
 
   next () {
@@ -155,7 +168,9 @@ class UploadPage extends React.Component {
               )}
               {current === steps.length - 1 && (
                 <Button type="primary" onClick={() => message.success('Processing complete!')}>
-                  <Link to="/ViewPage">Start Visualization</Link>
+                  <Link to={this.state.dataset ? `/ViewPage?dataset=${this.state.dataset}` : '/ViewPage'}>
+                    Start Visualization
+                  </Link>
                 </Button>
               )}
               {current > 0 && (
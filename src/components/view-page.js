@@ -23,7 +23,7 @@
 
 import React from 'react'
 import './view-page.css'
-import init from '../initialization';
+import init, { setDataset } from '../initialization';
 import JPS3D from '../3Dvisualization/JPS3D'
 
 import { Button, Cascader, Layout, Space, Modal, Image} from 'antd'
@@ -36,6 +36,9 @@ import axios from 'axios'
 class ViewPage extends React.Component {
   state = {
     url: '',
+    // Dataset of the uploaded files, named by the server on the first upload
+    // and passed on by the upload page as /ViewPage?dataset=ID
+    dataset: new URLSearchParams(this.props.location.search).get('dataset'),
     selectedFile: null,
     imgData: '',
 
@@ -46,7 +49,7 @@ class ViewPage extends React.Component {
   // Load 3D view as default
   componentDidMount(){
     (async () => {
-        const initResources = await init();
+        const initResources = await init(this.state.dataset);
         const jps3D = new JPS3D(initResources.geometryRootEl, initResources);
       }
     )();
@@ -80,8 +83,10 @@ class ViewPage extends React.Component {
   };
 
   // Fetch base64 data of plot depends on url
+  // (plots are served as png unless base64 is requested)
   toggleOpened() {
-    fetch(this.state.url)
+    const dataset = this.state.dataset ? `&dataset=${this.state.dataset}` : ''
+    fetch(`${this.state.url}?format=base64${dataset}`)
       .then(response => response.text())
       .then(data => {
         this.setState(prevState => ({imgData: data}))
@@ -100,9 +105,14 @@ class ViewPage extends React.Component {
 
     data.append('file', this.state.selectedFile)
 
+    const dataset = this.state.dataset ? `?dataset=${this.state.dataset}` : ''
     axios
-      .post('http://localhost:8080/upload', data, {})
+      .post(`http://localhost:8080/upload${dataset}`, data, {})
       .then(res => {
+        if (res.data.dataset) {
+          setDataset(res.data.dataset)
+          this.setState({dataset: res.data.dataset})
+        }
         onSuccess(file)
         console.log(res)
       })
@@ -149,7 +159,7 @@ class ViewPage extends React.Component {
         <Sider width={"25%"} theme={"light"} className="view-page-sider">
           <Space direction="vertical" align="center">
             <div onChange={this.onChangeHandler}>
-              <Dragger accept='.xml, .dat, .txt' customRequest={this.uploadToLocal}>
+              <Dragger accept='.xml, .dat, .txt, .gz, .xz, .zip' customRequest={this.uploadToLocal}>
                 <p className="ant-upload-drag-icon">
                   <InboxOutlined />
                 </p>
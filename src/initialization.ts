@@ -22,7 +22,7 @@
  */
 
 import {GeoFile} from './3Dvisualization/geometry'
-import {TraFile} from './3Dvisualization/trajectory'
+import {TraFile, TraColumns, TraWindow, decodeTrajectory} from './3Dvisualization/trajectory'
 
 export interface InitResources {
 	geometryData: GeoFile;
@@ -30,6 +30,32 @@ export interface InitResources {
 	trajectoryData: TraFile
 }
 
+// Dataset of the uploaded files, named by the server on the first upload.
+// null reads the files in the working directory of the server.
+let dataset: string | null = null;
+
+export function setDataset(id: string | null): void {
+	dataset = id;
+}
+
+export function getDataset(): string | null {
+	return dataset;
+}
+
+// Server URL of a resource of the current dataset
+function datasetUrl(url: string): string {
+	if (dataset === null) {
+		return url;
+	}
+	return `${url}${url.includes('?') ? '&' : '?'}dataset=${encodeURIComponent(dataset)}`;
+}
+
+// WebSocket URL of a resource of the current dataset
+function socketUrl(url: string): string {
+	const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+	return `${protocol}//${window.location.host}/${datasetUrl(url)}`;
+}
+
 function getOrThrow(id: string): HTMLElement {
 	const el = document.getElementById(id);
 	if (!el) {
@@ -39,7 +65,7 @@ function getOrThrow(id: string): HTMLElement {
 }
 
 async function fetchJson<T>(url: string): Promise<T> {
-	const response = await fetch(url);
+	const response = await fetch(datasetUrl(url));
 	if (response.status !== 200) {
 		console.log('non-200', url);
 		throw new Error(`Unable to load ${url}, response: ${response}`);
@@ -51,8 +77,232 @@ async function fetchJson<T>(url: string): Promise<T> {
 	return val;
 }
 
+async function fetchBuffer(url: string): Promise<ArrayBuffer> {
+	const response = await fetch(datasetUrl(url));
+	if (response.status !== 200) {
+		console.log('non-200', url);
+		throw new Error(`Unable to load ${url}, response: ${response}`);
+	}
+	const val = await response.arrayBuffer();
+
+	console.log(`Loaded ${url}`);
+
+	return val;
+}
+
+// Level of detail of /trajectory.bin: keep every stride-th frame (or the
+// stride closest to fps) and send coordinates quantized to quantize mm
+export interface TraDetail {
+	stride?: number;
+	fps?: number;
+	quantize?: number;
+}
+
+// Load the trajectory as typed-array columns from /trajectory.bin
+export async function fetchTrajectoryColumns(detail: TraDetail = {}): Promise<TraColumns> {
+	const params: [string, number | undefined][] = [
+		['stride', detail.stride], ['fps', detail.fps], ['quantize', detail.quantize]
+	];
+	const query = params
+		.filter(([, value]) => value !== undefined)
+		.map(([key, value]) => `${key}=${value}`)
+		.join('&');
+	return decodeTrajectory(await fetchBuffer(query ? `trajectory.bin?${query}` : 'trajectory.bin'));
+}
+
+// Load only the frames within [from, to] for playback of a time window
+export async function fetchTrajectoryWindow(from: number, to: number): Promise<TraWindow> {
+	return fetchJson<TraWindow>(`trajectory?from=${from}&to=${to}`);
+}
+
+// Data behind the analysis plots, for drawing them in the browser
+export interface NtData {
+	time: number[];
+	N: number[];
+}
+
+export interface RhoVData {
+	from: number;
+	to: number;
+	frame: number[];
+	density: number[];
+	velocity: number[];
+}
+
+// density[j][i] is the cell i along x and j along y, starting at extent[2]
+export interface ProfileData {
+	from: number;
+	to: number;
+	dx: number;
+	dy: number;
+	extent: [number, number, number, number];
+	density: number[][];
+	velocity: number[][];
+	mean_velocity: number;
+}
+
+export async function fetchNtData(): Promise<NtData> {
+	return fetchJson<NtData>('data/N_t');
+}
+
+export async function fetchRhoVData(): Promise<RhoVData> {
+	return fetchJson<RhoVData>('data/rho_v');
+}
+
+export async function fetchProfileData(from?: number, to?: number, dx = 0.2, dy = 0.2): Promise<ProfileData> {
+	const window = from === undefined || to === undefined ? '' : `from=${from}&to=${to}&`;
+	return fetchJson<ProfileData>(`data/profiles?${window}dx=${dx}&dy=${dy}`);
+}
+
+// Pedestrians inside a region, frames without any are left out
+export interface RegionQuery {
+	from: number | null;
+	to: number | null;
+	ids: number[];
+	frames: {frame: number, ids: number[]}[];
+}
+
+export interface NeighborsQuery {
+	frame: number;
+	k: number;
+	x: number;
+	y: number;
+	neighbors: {id: number, distance: number, coordinate: {x: number, y: number}}[];
+}
+
+// Pedestrians inside the rectangle [xmin, xmax] x [ymin, ymax] within frames [from, to]
+export async function fetchRegion(xmin: number, ymin: number, xmax: number, ymax: number,
+	from?: number, to?: number): Promise<RegionQuery> {
+	const window = from === undefined || to === undefined ? '' : `&from=${from}&to=${to}`;
+	return fetchJson<RegionQuery>(`query/region?bbox=${xmin},${ymin},${xmax},${ymax}${window}`);
+}
+
+// Pedestrians inside a polygon given as [[x, y], ...] within frames [from, to]
+export async function fetchPolygonRegion(polygon: [number, number][], from?: number, to?: number): Promise<RegionQuery> {
+	const window = from === undefined || to === undefined ? '' : `&from=${from}&to=${to}`;
+	return fetchJson<RegionQuery>(`query/region?polygon=${polygon.map((v) => v.join(',')).join(',')}${window}`);
+}
+
+// The k pedestrians closest to pedestrian id in a frame
+export async function fetchNeighbors(frame: number, id: number, k = 5): Promise<NeighborsQuery> {
+	return fetchJson<NeighborsQuery>(`query/neighbors?frame=${frame}&id=${id}&k=${k}`);
+}
+
+// Stream /trajectory?stream=1 and hand every frame to onFrame as soon as
+// its line has arrived, so rendering can start before the download ends.
+export async function streamTrajectory(onFrame: (frame: TraWindow['frames'][0]) => void): Promise<void> {
+	const response = await fetch(datasetUrl('trajectory?stream=1'));
+	if (response.status !== 200 || !response.body) {
+		throw new Error(`Unable to stream trajectory, response: ${response}`);
+	}
+
+	const reader = response.body.getReader();
+	const decoder = new TextDecoder();
+	let pending = '';
+	let headerRead = false;
+
+	for (;;) {
+		const {done, value} = await reader.read();
+		pending += done ? decoder.decode() : decoder.decode(value, {stream: true});
+
+		const lines = pending.split('\n');
+		pending = done ? '' : lines.pop();
+		for (const line of lines) {
+			if (line === '') {
+				continue;
+			}
+			if (headerRead) {
+				onFrame(JSON.parse(line));
+			}
+			headerRead = true;
+		}
+
+		if (done) {
+			break;
+		}
+	}
+}
+
+// Follow a trajectory that is still being written over /trajectory/live.
+// onFrame receives every frame as it arrives, and again with all its
+// locations when more of them arrive; onReset when the file starts over.
+export function followTrajectory(onFrame: (frame: TraWindow['frames'][0]) => void,
+	onReset: () => void, since?: number): WebSocket {
+	const query = since === undefined ? '' : `?since=${since}`;
+	const socket = new WebSocket(socketUrl(`trajectory/live${query}`));
+	socket.onmessage = (event: MessageEvent) => {
+		const message = JSON.parse(event.data);
+		if (message.type === 'reset') {
+			onReset();
+		} else {
+			message.frames.forEach(onFrame);
+		}
+	};
+	return socket;
+}
+
+const PLAYBACK_BATCH_HEADER_SIZE = 16;
+
+// Playback over /trajectory/play: the server sends batches of frames ahead
+// of the playhead and waits for consumed() before it sends further ones,
+// so neither side buffers more than a few batches of a long run.
+export class TrajectoryPlayback {
+	private socket: WebSocket;
+	// Batches before this one belong to the position before the last seek
+	private firstBatch = 0;
+
+	constructor(onBatch: (columns: TraColumns, batch: number) => void, onEnd: () => void = () => undefined,
+		quantize?: number) {
+		const query = quantize === undefined ? '' : `?quantize=${quantize}`;
+		this.socket = new WebSocket(socketUrl(`trajectory/play${query}`));
+		this.socket.binaryType = 'arraybuffer';
+		this.socket.onmessage = (event: MessageEvent) => {
+			if (typeof event.data === 'string') {
+				const message = JSON.parse(event.data);
+				if (message.type === 'seeked') {
+					this.firstBatch = message.batch;
+				} else if (message.type === 'end') {
+					onEnd();
+				} else if (message.type === 'error') {
+					console.log('playback error', message.message);
+				}
+				return;
+			}
+
+			const batch = new DataView(event.data).getUint32(4, true);
+			if (batch < this.firstBatch) {
+				this.consumed(batch);
+				return;
+			}
+			onBatch(decodeTrajectory(event.data.slice(PLAYBACK_BATCH_HEADER_SIZE)), batch);
+		};
+	}
+
+	// Play from frame (where playback stopped if undefined) at rate times real time
+	play(frame?: number, rate = 1): void {
+		const message = frame === undefined ? {type: 'play', rate: rate} : {type: 'play', frame: frame, rate: rate};
+		this.socket.send(JSON.stringify(message));
+	}
+
+	pause(): void {
+		this.socket.send(JSON.stringify({type: 'pause'}));
+	}
+
+	// The playhead has reached the batch, the server may send the next one
+	consumed(batch: number): void {
+		this.socket.send(JSON.stringify({type: 'ack', batch: batch}));
+	}
 
-export default async function init (): Promise<InitResources> {
+	close(): void {
+		this.socket.close();
+	}
+}
+
+// Load geometry and trajectory of <id>, of the current dataset if undefined
+export default async function init (id?: string | null): Promise<InitResources> {
+	if (id !== undefined) {
+		setDataset(id);
+	}
 	const loadStartMs = window.performance.now();
 	const geoData = await fetchJson<GeoFile>('geometry');
 	const traData = await fetchJson<TraFile>('trajectory')
@@ -0,0 +1,115 @@
+#  \file archives.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+
+# Streaming decompression of uploaded archives.
+#
+# Uploads are async iterators of byte chunks. .gz and .xz uploads are
+# decompressed chunk by chunk as they arrive; a .zip has its directory at
+# the end, so it is stored first and its members are then read one chunk
+# at a time. All (de)compression work runs in a thread, and no step
+# produces more than MAX_PIECE bytes at once, so archives that expand
+# enormously never have to fit into memory.
+import asyncio
+import lzma
+import os
+import zipfile
+import zlib
+
+# Largest piece of decompressed data produced by one step
+MAX_PIECE = 1024 * 1024
+COMPRESSED_SUFFIXES = ['.gz', '.xz']
+
+
+class GzipStream:
+    """ Decompression of (possibly multi-member) gzip data """
+
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def pieces(self, data):
+        while data:
+            yield self.decompressor.decompress(data, MAX_PIECE)
+            data = self.decompressor.unconsumed_tail
+            if self.decompressor.eof:
+                # Concatenated members, e.g. written by pigz or bgzip
+                data = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class XzStream:
+    def __init__(self):
+        self.decompressor = lzma.LZMADecompressor()
+
+    def pieces(self, data):
+        yield self.decompressor.decompress(data, MAX_PIECE)
+        while not self.decompressor.needs_input and not self.decompressor.eof:
+            yield self.decompressor.decompress(b'', MAX_PIECE)
+
+
+STREAMS = {
+    '.gz': GzipStream,
+    '.xz': XzStream,
+}
+
+
+def compression(filename):
+    """ Suffix of a compressed file name ('.gz', '.xz') or None """
+    suffix = os.path.splitext(filename)[1].lower()
+    return suffix if suffix in STREAMS else None
+
+
+async def decompress(chunks, suffix):
+    """ Decompressed chunks of the compressed <chunks> """
+    loop = asyncio.get_event_loop()
+    stream = STREAMS[suffix]()
+    async for chunk in chunks:
+        pieces = stream.pieces(chunk)
+        while True:
+            piece = await loop.run_in_executor(None, next, pieces, None)
+            if piece is None:
+                break
+            if piece:
+                yield piece
+
+
+def zip_members(zip_path):
+    """ Names of the files in a zip archive, without directories and macOS metadata """
+    with zipfile.ZipFile(zip_path) as archive:
+        return [info.filename for info in archive.infolist()
+                if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+                and not os.path.basename(info.filename).startswith('._')]
+
+
+async def zip_member_chunks(zip_path, name):
+    """ Decompressed chunks of one member of a stored zip archive """
+    loop = asyncio.get_event_loop()
+    archive = await loop.run_in_executor(None, zipfile.ZipFile, zip_path)
+    try:
+        member = await loop.run_in_executor(None, archive.open, name)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, member.read, MAX_PIECE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            member.close()
+    finally:
+        archive.close()
@@ -0,0 +1,102 @@
+#  \file datasets.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+
+# Per-dataset workspaces.
+#
+# Every upload without a dataset ID creates a dataset with its own
+# directory datasets/<id>/ for the uploaded files and its own render
+# cache, so concurrent users never overwrite each other's inputs. Parsed
+# inputs stay in the content-addressed ingestion cache, which is safe to
+# share: equal content has equal hashes.
+#
+# Requests without a dataset ID use the default workspace, the files in
+# the working directory of the server.
+import os
+import re
+import shutil
+import uuid
+
+import render
+
+DATASETS_DIR = 'datasets'
+DEFAULT_DATASET = 'default'
+DATASET_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class Workspace:
+    """ Storage directory and render cache of one dataset """
+
+    def __init__(self, dataset_id, directory, render_cache):
+        self.id = dataset_id
+        self.directory = directory
+        self.render_cache = render_cache
+
+    def path(self, filename):
+        """ Path of an input file (e.g. 'trajectory.txt') of the dataset """
+        return os.path.join(self.directory, filename)
+
+
+class Workspaces:
+    """ Registry of the datasets, workspaces are opened on first use """
+
+    def __init__(self, root=DATASETS_DIR, executor=None):
+        self.root = root
+        self.executor = executor
+        self.workspaces = {
+            DEFAULT_DATASET: Workspace(DEFAULT_DATASET, '.', render.RenderCache(executor=executor))
+        }
+
+    def open(self, dataset_id, directory):
+        workspace = Workspace(dataset_id, directory, render.RenderCache(
+            os.path.join(directory, 'render'), executor=self.executor))
+        self.workspaces[dataset_id] = workspace
+        return workspace
+
+    def get(self, dataset_id=None):
+        """ Workspace of <dataset_id>, the default workspace if None
+
+        :raises KeyError: for unknown or malformed IDs
+        """
+        if dataset_id is None:
+            dataset_id = DEFAULT_DATASET
+        workspace = self.workspaces.get(dataset_id)
+        if workspace is not None:
+            return workspace
+
+        # Datasets of earlier runs are found on disk
+        directory = os.path.join(self.root, dataset_id)
+        if not DATASET_ID.match(dataset_id) or not os.path.isdir(directory):
+            raise KeyError(dataset_id)
+        return self.open(dataset_id, directory)
+
+    def create(self):
+        dataset_id = uuid.uuid4().hex
+        directory = os.path.join(self.root, dataset_id)
+        os.makedirs(directory)
+        return self.open(dataset_id, directory)
+
+    def remove(self, workspace):
+        """ Delete a dataset with its files, e.g. one whose upload was rejected """
+        self.workspaces.pop(workspace.id, None)
+        shutil.rmtree(workspace.directory, ignore_errors=True)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
@@ -0,0 +1,252 @@
+#  \file ingest.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+
+# Parse-once cache for uploaded input files.
+#
+# Every input file is parsed a single time into cache/<kind>/<hash>/,
+# where <hash> is the SHA-1 of the file content. Numeric data is stored
+# as .npy files and opened memory-mapped, so worker processes serving
+# the same dataset share pages through the OS page cache.
+import collections
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from analysis import geometry
+
+import trajectory
+
+CACHE_DIR = 'cache'
+HASH_CHUNK_SIZE = 1 << 20
+# Parsed objects kept in memory, the least recently used is dropped first
+LOADED_ENTRIES = 16
+
+# Numeric columns of IFD.dat, the Voronoi polygon column 'p' is not cached
+IFD_COLUMNS = ['f', 'i', 'x', 'y', 'z/m', 'd', 'v']
+IFD_NAMES = IFD_COLUMNS + ['p']
+
+# Ingestion kind of the input files of a workspace
+FILE_KINDS = {
+    'trajectory.txt': 'trajectory',
+    'geometry.xml': 'geometry',
+    'IFD.dat': 'IFD',
+    'rho_v.dat': 'rho_v',
+    'N_t.dat': 'N_t',
+}
+
+# filepath -> (mtime_ns, size, hash)
+file_hashes = {}
+# (kind, filepath) -> (hash, parsed object), filepath is None for derived data
+loaded = collections.OrderedDict()
+
+
+def known_hash(filepath):
+    """ Content hash of the file if it is known and mtime and size did not change, else None """
+    stat = os.stat(filepath)
+    cached = file_hashes.get(filepath)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    return None
+
+
+def content_hash(filepath):
+    """ SHA-1 of the file content, only recomputed when mtime or size change """
+    digest = known_hash(filepath)
+    if digest is not None:
+        return digest
+
+    stat = os.stat(filepath)
+    sha = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    file_hashes[filepath] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def remember_hash(filepath, digest):
+    """ Record the content hash of a file, e.g. computed while it was uploaded """
+    stat = os.stat(filepath)
+    file_hashes[filepath] = (stat.st_mtime_ns, stat.st_size, digest)
+
+
+def cache_path(kind, digest):
+    return os.path.join(CACHE_DIR, kind, digest)
+
+
+# Writers parse <filepath> and store the result in <directory>
+def write_trajectory(filepath, directory):
+    trajectory.save_trajectory(trajectory.load_trajectory(filepath), directory)
+
+
+def write_geometry(filepath, directory):
+    geometry.Geometry.parse(filepath).save(directory)
+
+
+def write_IFD(filepath, directory):
+    df = pd.read_csv(filepath, comment='#', sep='\t', names=IFD_NAMES,
+                     usecols=IFD_COLUMNS, index_col=False)
+    for k, name in enumerate(IFD_COLUMNS):
+        np.save(os.path.join(directory, 'col{}.npy'.format(k)), df[name].to_numpy())
+
+
+def write_table(filepath, directory):
+    np.save(os.path.join(directory, 'data.npy'), np.loadtxt(filepath, ndmin=2))
+
+
+# Readers open a cache directory created by the matching writer
+def read_trajectory(directory):
+    return trajectory.open_trajectory(directory)
+
+
+def read_geometry(directory):
+    return geometry.Geometry.load(directory)
+
+
+def read_IFD(directory):
+    """ IFD data as a dict of memory mapped columns, named as in plot_profiles.read_IFD (without 'p') """
+    return {name: trajectory.load_array(os.path.join(directory, 'col{}.npy'.format(k)))
+            for k, name in enumerate(IFD_COLUMNS)}
+
+
+def read_table(directory):
+    return trajectory.load_array(os.path.join(directory, 'data.npy'))
+
+
+KINDS = {
+    'trajectory': (write_trajectory, read_trajectory),
+    'geometry': (write_geometry, read_geometry),
+    'IFD': (write_IFD, read_IFD),
+    'rho_v': (write_table, read_table),
+    'N_t': (write_table, read_table),
+}
+
+
+def store(directory, write):
+    """ Create cache entry <directory> by calling write(tmp_directory)
+
+    The entry is written to a temporary directory and renamed, so
+    concurrent writers of the same entry never expose a half-written one.
+    """
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(directory))
+    try:
+        write(tmp)
+        os.rename(tmp, directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+
+
+def is_ingested(kind, digest):
+    """ Whether the cache holds the parsed content of hash <digest>, False for None """
+    return digest is not None and os.path.isdir(cache_path(kind, digest))
+
+
+def ingest(kind, filepath, digest=None):
+    """ Parse <filepath> into the cache unless its content is cached already
+
+    :param kind: one of KINDS
+    :param digest: content hash of the file if known, saves reading it twice
+    :returns: content hash of the file
+    """
+    if digest is None:
+        digest = content_hash(filepath)
+    directory = cache_path(kind, digest)
+    if not os.path.isdir(directory):
+        write, _ = KINDS[kind]
+        store(directory, lambda tmp: write(filepath, tmp))
+    return digest
+
+
+def cached_data(key, digest):
+    """ Parsed object of <key> in memory if it is still the one of <digest> """
+    cached = loaded.get(key)
+    if cached is None or cached[0] != digest:
+        return None
+    loaded.move_to_end(key)
+    return cached[1]
+
+
+def keep_data(key, digest, data):
+    loaded[key] = (digest, data)
+    loaded.move_to_end(key)
+    while len(loaded) > LOADED_ENTRIES:
+        loaded.popitem(last=False)
+
+
+def load(kind, filepath):
+    """ Parsed content of <filepath>, ingesting the file on first use
+
+    The parsed object is kept in memory until the file content changes or
+    LOADED_ENTRIES more recently used objects are loaded.
+    """
+    digest = ingest(kind, filepath)
+    data = cached_data((kind, filepath), digest)
+    if data is not None:
+        return data
+
+    _, read = KINDS[kind]
+    data = read(cache_path(kind, digest))
+    keep_data((kind, filepath), digest, data)
+    return data
+
+
+def derived_directory(kind, key, write):
+    """ Cache directory of data derived from ingested files, written once
+
+    :param kind: name of the derived data
+    :param key: JSON serializable list of everything the data depends on,
+                typically content hashes and parameters
+    :param write: write(directory) computes the data and stores it in directory
+    :returns: (key digest, directory)
+    """
+    digest = hashlib.sha1(json.dumps([kind, key]).encode('utf-8')).hexdigest()
+    directory = cache_path(kind, digest)
+    if not os.path.isdir(directory):
+        store(directory, write)
+    return digest, directory
+
+
+def load_derived(kind, key, write, read):
+    """ Data derived from ingested files (e.g. an index), computed once
+
+    :param kind, key, write: see derived_directory
+    :param read: read(directory) opens the stored data
+    """
+    digest, directory = derived_directory(kind, key, write)
+
+    # Keep the most recently used entry of every kind in memory
+    data = cached_data((kind, None), digest)
+    if data is not None:
+        return data
+
+    data = read(directory)
+    keep_data((kind, None), digest, data)
+    return data
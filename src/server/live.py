@@ -0,0 +1,146 @@
+#  \file live.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+
+# Live view of trajectories that are still being written.
+#
+# A LiveTrajectory follows one trajectory file with a TrajectoryTail while
+# viewers are subscribed: new lines are parsed in a thread every
+# LIVE_POLL_SECONDS and the frames that received rows are published to
+# every subscriber as JSON text messages:
+#
+#   {"type": "frames", "frames": [{"frame", "locations"}, ...]}
+#   {"type": "reset"}   the file was truncated (e.g. a new run), drop all frames
+#
+# A new viewer is first sent the whole file directly, only frames appended
+# after it subscribed go through its queue. A frame is sent again with all
+# its rows when more of them arrive, so viewers replace frames by number.
+# Subscribers have a bounded queue; one that does not keep up is
+# disconnected instead of growing server memory.
+import asyncio
+import json
+
+import trajectory
+
+LIVE_POLL_SECONDS = 0.5
+# Messages queued per subscriber before it is dropped
+LIVE_QUEUE_MESSAGES = 64
+# Frames per message
+LIVE_BATCH_FRAMES = 50
+
+
+def frames_messages(traj, first, last):
+    """ "frames" messages of the frames within [first, last] """
+    for batch in traj.iter_frames(first, last, LIVE_BATCH_FRAMES):
+        yield json.dumps({'type': 'frames', 'frames': batch}, ensure_ascii=False)
+
+
+class LiveTrajectory:
+    """ Tail of one trajectory file and the queues of its subscribers
+
+    The tail is kept after the last subscriber leaves, so later viewers
+    continue where it stopped and nothing is parsed twice.
+    """
+
+    def __init__(self, filepath):
+        self.tail = trajectory.TrajectoryTail(filepath)
+        self.subscribers = set()
+        self.task = None
+        # Only one read of the tail at a time
+        self.reading = asyncio.Lock()
+
+    def subscribe(self):
+        """ Queue of the messages for a new subscriber, None marks a dropped one """
+        queue = asyncio.Queue(LIVE_QUEUE_MESSAGES)
+        self.subscribers.add(queue)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.follow())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, message):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def update(self):
+        """ Read the lines appended since the last read and publish their frames
+
+        :returns: whether the file holds more than was read
+        """
+        async with self.reading:
+            try:
+                columns, truncated, offset = await asyncio.get_event_loop().run_in_executor(
+                    None, self.tail.read)
+            except FileNotFoundError:
+                return False
+            # A cancelled read is not appended and leaves the offset, so its
+            # rows are read again
+            changed = self.tail.append(columns, truncated, offset)
+            if truncated:
+                self.publish(json.dumps({'type': 'reset'}))
+            if changed is not None:
+                for message in frames_messages(self.tail.trajectory, *changed):
+                    self.publish(message)
+            return self.tail.more
+
+    async def catch_up(self):
+        """ Read up to the current end of the file
+
+        Called before a new viewer takes the tail's frames, which it is sent
+        directly rather than through its bounded queue.
+        """
+        while await self.update():
+            pass
+
+    async def follow(self):
+        while True:
+            if not await self.update():
+                await asyncio.sleep(LIVE_POLL_SECONDS)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+class LiveTrajectories:
+    """ LiveTrajectory of every followed file """
+
+    def __init__(self):
+        self.files = {}
+
+    def get(self, filepath):
+        live = self.files.get(filepath)
+        if live is None:
+            live = self.files[filepath] = LiveTrajectory(filepath)
+        return live
+
+    def stop(self):
+        for live in self.files.values():
+            live.stop()
@@ -0,0 +1,141 @@
+#  \file playback.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+
+# Playback of a trajectory over a WebSocket, paced by the viewer.
+#
+# The viewer controls playback with JSON text messages:
+#
+#   {"type": "play", "frame": F, "rate": R}   play from frame F (optional,
+#                                            default: where it stopped) at R
+#                                            times real time (default 1)
+#   {"type": "pause"}
+#   {"type": "ack", "batch": N}              batch N (and all before) arrived
+#
+# The server answers with binary batches of consecutive frames, each the
+# BATCH_HEADER followed by a /trajectory.bin buffer of its rows. At most
+# PLAYBACK_WINDOW batches are sent ahead of the last acknowledged one, so
+# a slow viewer slows the stream down instead of queueing data on either
+# side. Batches cover PLAYBACK_BATCH_SECONDS of playback, a seek costs one
+# batch of latency. After a play with a frame the server sends
+# {"type": "seeked", "batch": N}: batches before N belong to the old
+# position and are to be dropped. {"type": "end"} follows the last frame,
+# playback pauses there; a play without a frame at the end is answered with
+# another "end".
+import json
+import math
+import struct
+
+import numpy as np
+
+# 'JPSB', uint32 batch number, int32 first and last frame of the batch
+BATCH_MAGIC = b'JPSB'
+BATCH_HEADER = struct.Struct('<4sIii')
+# Batches sent but not yet acknowledged
+PLAYBACK_WINDOW = 3
+PLAYBACK_BATCH_SECONDS = 1.0
+# Frames per batch of trajectories without framerate
+PLAYBACK_BATCH_FRAMES = 8
+
+
+class Playback:
+    """ Playback state of one viewer
+
+    :param traj: Trajectory to play
+    :param step: quantization step in metres (see Trajectory.to_quantized_binary),
+                 None for float32 columns
+    """
+
+    def __init__(self, traj, step=None):
+        self.traj = traj
+        self.step = step
+        # Position in traj.frames of the next frame to send
+        self.position = 0
+        self.rate = 1.0
+        self.playing = False
+        self.next_batch = 0
+        self.acknowledged = -1
+
+    def header(self):
+        first, last = self.traj.frame_range()
+        return json.dumps(dict(self.traj.window_header(first, last), type='header',
+                               frames=len(self.traj.frames)))
+
+    def control(self, message):
+        """ Apply a message of the viewer
+
+        :returns: message to answer, None if there is nothing to answer
+        :raises ValueError: for malformed messages
+        """
+        if not isinstance(message, dict):
+            raise ValueError('messages must be JSON objects')
+        kind = message.get('type')
+        if kind == 'ack':
+            self.acknowledged = max(self.acknowledged, int(message['batch']))
+        elif kind == 'pause':
+            self.playing = False
+        elif kind == 'play':
+            self.rate = float(message.get('rate', self.rate))
+            if not self.rate > 0:
+                raise ValueError('rate must be positive')
+            self.playing = True
+            if 'frame' in message:
+                self.position = int(np.searchsorted(self.traj.frames, int(message['frame'])))
+                # Batches of the old position are not waited for
+                self.acknowledged = self.next_batch - 1
+                return json.dumps({'type': 'seeked', 'batch': self.next_batch})
+        else:
+            raise ValueError('unknown message type {}'.format(kind))
+        return None
+
+    def ready(self):
+        """ Whether the next batch, or the end, may be sent """
+        if self.position >= len(self.traj.frames):
+            return self.playing
+        return self.playing and self.next_batch - self.acknowledged <= PLAYBACK_WINDOW
+
+    def batch_frames(self):
+        if self.traj.framerate is None:
+            return PLAYBACK_BATCH_FRAMES
+        return max(1, int(math.ceil(PLAYBACK_BATCH_SECONDS * self.traj.framerate * self.rate)))
+
+    def next(self):
+        """ Encode the next batch and advance the playhead, pauses after the last frame
+
+        :returns: (binary batch, whether it holds the last frame),
+                  (None, True) when the playhead is past the last frame
+        """
+        frames = self.traj.frames
+        if self.position >= len(frames):
+            self.playing = False
+            return None, True
+        stop = min(self.position + self.batch_frames(), len(frames))
+        first, last = int(frames[self.position]), int(frames[stop - 1])
+        rows = self.traj.rows_in_frames(first, last)
+        if self.step is None:
+            body = self.traj.to_binary(rows)
+        else:
+            body = self.traj.to_quantized_binary(rows, step=self.step)
+
+        header = BATCH_HEADER.pack(BATCH_MAGIC, self.next_batch, first, last)
+        self.position = stop
+        self.next_batch += 1
+        if stop == len(frames):
+            self.playing = False
+        return header + body, stop == len(frames)
@@ -0,0 +1,218 @@
+#  \file plots.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+
+# Plot and data jobs executed in the render worker processes.
+#
+# Jobs take file names only and load their data from the ingestion
+# cache inside the worker, so no arrays are pickled between processes.
+# The figures are closed afterwards to keep long-lived workers small.
+import json
+import os
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from analysis import _Plot_N_t
+from analysis import plot_profiles
+from analysis import plot_FD
+from analysis import spatial
+
+import ingest
+
+def render_Nt(nt_file, figname):
+    # plot_Nt changes the global font size, keep that out of later jobs
+    try:
+        with plt.rc_context():
+            _Plot_N_t.plot_Nt(nt_file, ingest.load('N_t', nt_file), figname)
+    finally:
+        plt.close('all')
+
+
+def load_profile_index(IFDfile, limits, xbins, ybins, dx, dy):
+    data = ingest.load('IFD', IFDfile)
+    return ingest.load_derived(
+        'profile_index', [ingest.content_hash(IFDfile), [float(l) for l in limits], dx, dy],
+        lambda directory: plot_profiles.ProfileIndex.build(data, xbins, ybins).save(directory),
+        lambda directory: plot_profiles.ProfileIndex.load(directory, data, xbins, ybins))
+
+
+def window_profiles(geofile, IFDfile, beginFrame, endFrame, dx, dy):
+    """ profile_statistics of a frame window, answered from the ProfileIndex
+
+    :returns: profiles, xbins, ybins, geometry_wall, limits, (first, last frame)
+    """
+    geometry_wall, limits, xbins, ybins = plot_profiles.profile_grid(
+        geofile, dx, dy, ingest.load('geometry', geofile))
+    index = load_profile_index(IFDfile, limits, xbins, ybins, dx, dy)
+    frames = index.frame_limits(beginFrame, endFrame)
+    profiles = plot_profiles.profile_statistics(index.sums(*frames))
+    return profiles, xbins, ybins, geometry_wall, limits, frames
+
+
+def render_profiles(geofile, IFDfile, beginFrame, endFrame, dx, dy, density_figname, velocity_figname):
+    """ Density and velocity profiles of a frame window """
+    try:
+        profiles, xbins, ybins, geometry_wall, limits, frames = window_profiles(
+            geofile, IFDfile, beginFrame, endFrame, dx, dy)
+        plot_profiles.plot_profile_figures(profiles, xbins, ybins, geometry_wall, limits, frames,
+                                           density_figname, velocity_figname)
+    finally:
+        plt.close('all')
+
+
+def profile_data(geofile, IFDfile, beginFrame, endFrame, dx, dy):
+    """ Profile matrices of a frame window for client-side rendering
+
+    Rows of the (ny, nx) matrices run along y from extent[2] upwards,
+    like the images of plot_profile_figures (origin='lower').
+    """
+    profiles, xbins, ybins, geometry_wall, limits, frames = window_profiles(
+        geofile, IFDfile, beginFrame, endFrame, dx, dy)
+    return {
+        'from': frames[0],
+        'to': frames[1],
+        'dx': dx,
+        'dy': dy,
+        'extent': [float(l) for l in limits],
+        'density': profiles['density'].tolist(),
+        'velocity': profiles['velocity'].tolist(),
+        'mean_velocity': float(profiles['mean_velocity']),
+    }
+
+
+def render_FD(kind, rho_v_file, figname):
+    try:
+        plot_FD.FD_PLOTS[kind](rho_v_file, ingest.load('rho_v', rho_v_file), figname)
+    finally:
+        plt.close('all')
+
+
+def write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def trajectory_lod(tra_file, first, last, stride, step):
+    """ /trajectory.bin of a level of detail
+
+    The whole trajectory is encoded once per (stride, step) and cached,
+    frame windows are encoded on every request.
+
+    :param first, last: frame window, None for the whole trajectory
+    :param stride: frame stride, see Trajectory.rows_in_frames
+    :param step: quantization step in metres, None for float32 columns
+    """
+    traj = ingest.load('trajectory', tra_file)
+
+    def encode(rows):
+        if step is None:
+            return traj.to_binary(rows, stride)
+        return traj.to_quantized_binary(rows, stride, step)
+
+    if first is not None:
+        return encode(traj.rows_in_frames(first, last, stride))
+
+    def write(directory):
+        rows = traj.rows_in_frames(*traj.frame_range(), stride)
+        write_file(os.path.join(directory, 'trajectory.bin'), encode(rows))
+
+    _, directory = ingest.derived_directory(
+        'trajectory_lod', [ingest.content_hash(tra_file), stride, step], write)
+    with open(os.path.join(directory, 'trajectory.bin'), 'rb') as f:
+        return f.read()
+
+
+def trajectory_overview(tra_file, stride):
+    """ /trajectory JSON document of every <stride>-th frame, encoded once per stride and cached """
+    traj = ingest.load('trajectory', tra_file)
+
+    def write(directory):
+        rows = traj.rows_in_frames(*traj.frame_range(), stride)
+        write_file(os.path.join(directory, 'trajectory.json'),
+                   json.dumps(traj.to_dict(rows, stride), ensure_ascii=False).encode('utf-8'))
+
+    _, directory = ingest.derived_directory(
+        'trajectory_overview', [ingest.content_hash(tra_file), stride], write)
+    with open(os.path.join(directory, 'trajectory.json'), 'rb') as f:
+        return f.read()
+
+
+def load_grid(tra_file):
+    """ Trajectory of <tra_file> and its spatial.FrameGrid, built once per content """
+    traj = ingest.load('trajectory', tra_file)
+    grid = ingest.load_derived(
+        'trajectory_grid', [ingest.content_hash(tra_file), spatial.CELL_SIZE],
+        lambda directory: spatial.FrameGrid.build(traj['frame'], traj['x'], traj['y']).save(directory),
+        lambda directory: spatial.FrameGrid.load(directory, traj['frame'], traj['x'], traj['y']))
+    return traj, grid
+
+
+def query_region(tra_file, first, last, rectangle=None, polygon=None):
+    """ Pedestrians inside a rectangle or polygon in the frames within [first, last]
+
+    :param first, last: frame window, None for open ends
+    :param rectangle: (xmin, xmax, ymin, ymax)
+    :param polygon: (n, 2) vertices or x1, y1, x2, y2, ..., used instead of <rectangle> if given
+    :returns: {'ids': all ids found, 'frames': [{'frame', 'ids'}]} for the frames with pedestrians inside
+    """
+    traj, grid = load_grid(tra_file)
+    if polygon is not None:
+        rows = grid.in_polygon(polygon, first, last)
+    else:
+        rows = grid.in_rectangle(*rectangle, first, last)
+
+    # Rows are ordered by frame
+    frames, starts = np.unique(traj['frame'][rows], return_index=True)
+    ids = traj['id'][rows]
+    return {
+        'ids': np.unique(ids).tolist(),
+        'frames': [{'frame': int(frame), 'ids': np.sort(frame_ids).tolist()}
+                   for frame, frame_ids in zip(frames, np.split(ids, starts[1:]))],
+    }
+
+
+def query_neighbors(tra_file, frame, k, ped_id=None, x=None, y=None):
+    """ The <k> pedestrians closest to pedestrian <ped_id> or to (x, y) in <frame>
+
+    :raises KeyError: if <ped_id> is not in <frame>
+    :returns: {'x', 'y', 'neighbors': [{'id', 'distance', 'coordinate'}]}, nearest first
+    """
+    traj, grid = load_grid(tra_file)
+    row = None
+    if ped_id is not None:
+        rows = traj.rows_in_frames(frame, frame)
+        rows = rows[traj['id'][rows] == ped_id]
+        if len(rows) == 0:
+            raise KeyError('pedestrian {} is not in frame {}'.format(ped_id, frame))
+        row = rows[0]
+        x, y = float(traj['x'][row]), float(traj['y'][row])
+
+    rows, distances = grid.nearest(frame, x, y, k, exclude=row)
+    return {
+        'x': x,
+        'y': y,
+        'neighbors': [
+            {'id': int(traj['id'][r]), 'distance': float(d),
+             'coordinate': {'x': float(traj['x'][r]), 'y': float(traj['y'][r])}}
+            for r, d in zip(rows, distances)
+        ],
+    }
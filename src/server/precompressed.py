@@ -0,0 +1,117 @@
+#  \file precompressed.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+
+# Precompressed JSON documents.
+#
+# The full /trajectory and /geometry documents are compressed once per
+# content hash and encoding, stored in the ingestion cache next to the
+# parsed data and sent as they are on later requests. Compression runs in
+# the render workers; Brotli is used when the module is installed. Clients
+# accepting neither get the uncompressed document, cached the same way as
+# encoding "identity".
+import gzip
+import json
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import ingest
+
+GZIP_LEVEL = 9
+# Quality 11 takes minutes for large trajectories, 9 is close in size
+BROTLI_QUALITY = 9
+
+# Supported encodings, preferred first
+ENCODINGS = (['br'] if brotli is not None else []) + ['gzip']
+
+
+def trajectory_document(traj):
+    return json.dumps(traj.to_dict(), ensure_ascii=False)
+
+
+def geometry_document(geometry):
+    return geometry.to_json()
+
+
+# Ingestion kind -> function building the JSON text from the parsed data
+DOCUMENTS = {
+    'trajectory': trajectory_document,
+    'geometry': geometry_document,
+}
+
+
+def negotiate(accept_encoding):
+    """ Preferred encoding of ENCODINGS accepted by an Accept-Encoding header, None for none
+
+    Encodings are ranked by their q-value, ties go to the order of ENCODINGS.
+    """
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        weight = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+
+    accepted = [(weights.get(encoding, weights.get('*', 0.0)), -k, encoding)
+                for k, encoding in enumerate(ENCODINGS)]
+    weight, _, encoding = max(accepted)
+    return encoding if weight > 0 else None
+
+
+def compress(data, encoding):
+    if encoding == 'identity':
+        return data
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical documents
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+
+def document_path(kind, digest, encoding):
+    """ Cache path of the document of a file with content hash <digest> in <encoding> """
+    return os.path.join(ingest.cache_path(kind, digest), 'document.' + encoding)
+
+
+def encode_document(kind, filepath, digest, encoding):
+    """ Compress the document of <filepath> into the cache, unless it is there already
+
+    Runs in a render worker. <digest> is the content hash of the file.
+
+    :returns: path of the compressed document
+    """
+    path = document_path(kind, digest, encoding)
+    if not os.path.exists(path):
+        data = DOCUMENTS[kind](ingest.load(kind, filepath)).encode('utf-8')
+        # Write and rename, readers never see a partial document
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(compress(data, encoding))
+        os.replace(tmp, path)
+    return path
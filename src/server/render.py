@@ -0,0 +1,158 @@
+#  \file render.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import functools
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+RENDER_CACHE_DIR = os.path.join('cache', 'render')
+# Upper bound of the total size of cached plots
+RENDER_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def render_key(kind, inputs, params=None):
+    """ Cache key of a plot
+
+    :param kind: plot kind, e.g. 'density_frame'
+    :param inputs: {input file: content hash} the plot is rendered from
+    :param params: plot parameters (JSON serializable)
+    """
+    description = json.dumps([kind, sorted(inputs.values()), params or {}], sort_keys=True)
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """ Size-bounded LRU cache of rendered plots, stored as <key>.png
+
+    Keys cover the content hashes of the input files, so an upload with
+    new content never hits a plot of the old one. Plots of replaced
+    inputs are dropped by invalidate(), the rest is evicted least
+    recently used first once the total size exceeds max_bytes.
+
+    Plots are rendered in <executor> (e.g. a ProcessPoolExecutor) so the
+    event loop stays responsive; None renders in the calling thread.
+    """
+
+    def __init__(self, directory=RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_BYTES, executor=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.executor = executor
+        # Renders in progress, shared by concurrent requests for the same plots
+        self.pending = {}
+        # key -> (size, inputs), least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Adopt plots from earlier runs, oldest access first. Their inputs
+        # are unknown, so they only leave the cache through eviction.
+        names = [n for n in os.listdir(directory) if n.endswith('.png') and '.tmp' not in n]
+        names.sort(key=lambda n: os.path.getmtime(os.path.join(directory, n)))
+        for name in names:
+            self.add(name[:-len('.png')], os.path.getsize(os.path.join(directory, name)), {})
+        self.evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.png')
+
+    def add(self, key, size, inputs):
+        self.discard(key)
+        self.entries[key] = (size, inputs)
+        self.total_bytes += size
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[0]
+
+    def remove(self, key):
+        self.discard(key)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            self.remove(key)
+
+    def get(self, key):
+        """ Path of the cached plot, or None on a miss """
+        if key not in self.entries:
+            return None
+        path = self.path(key)
+        if not os.path.exists(path):
+            self.discard(key)
+            return None
+        self.entries.move_to_end(key)
+        os.utime(path)
+        return path
+
+    def tmp_path(self, key):
+        return os.path.join(self.directory, '{}.tmp{}.png'.format(key, os.getpid()))
+
+    def store(self, key, tmp_path, inputs):
+        """ Move a plot written to tmp_path(key) into the cache """
+        path = self.path(key)
+        os.replace(tmp_path, path)
+        self.add(key, os.path.getsize(path), inputs)
+        self.evict()
+        return path
+
+    def invalidate(self, filepath, digest):
+        """ Drop plots rendered from an older content of <filepath> """
+        for key, (size, inputs) in list(self.entries.items()):
+            if filepath in inputs and inputs[filepath] != digest:
+                self.remove(key)
+
+    async def render(self, kinds, inputs, params, plot, *args):
+        """ Paths of the plots <kinds>, rendering them on a miss
+
+        :param kinds: plot kinds produced together by one call of <plot>
+        :param inputs: {input file: content hash}
+        :param params: plot parameters, part of the key
+        :param plot: picklable callable, called as plot(*args, *paths) to
+                     write one plot per kind to the given paths
+        :returns: list of paths, one per kind
+        """
+        keys = tuple(render_key(kind, inputs, params) for kind in kinds)
+        paths = [self.get(key) for key in keys]
+        if all(paths):
+            return paths
+
+        if keys not in self.pending:
+            self.pending[keys] = asyncio.ensure_future(self.run(keys, inputs, plot, args))
+        # A client going away must not cancel a render other requests wait for
+        return await asyncio.shield(self.pending[keys])
+
+    async def run(self, keys, inputs, plot, args):
+        try:
+            tmp_paths = [self.tmp_path(key) for key in keys]
+            job = functools.partial(plot, *args, *tmp_paths)
+            if self.executor is None:
+                job()
+            else:
+                await asyncio.get_event_loop().run_in_executor(self.executor, job)
+            return [self.store(key, tmp, inputs) for key, tmp in zip(keys, tmp_paths)]
+        finally:
+            del self.pending[keys]
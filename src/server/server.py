@@ -26,237 +26,870 @@ import asyncio
 import logging
 import pathlib
 import base64
+import functools
+import hashlib
 import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
 from numpy import *
 
-from xml.etree import ElementTree as ET
-import xmltodict
 import sys
 
 BASE_DIR=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(BASE_DIR)
 
-from analysis import _Plot_N_t
-from analysis import plot_profiles
 from analysis import plot_FD
+from analysis import plot_profiles
+
+import archives
+import datasets
+import ingest
+import live
+import playback
+import plots
+import precompressed
+import render
 
 # Base directory
 PROJ_ROOT = pathlib.Path(__file__).parent.parent.parent
 NO_CACHE_HEADER = {'cache-control': 'no-cache'}
+# Number of frames serialized per chunk of a streamed trajectory
+STREAM_BATCH_FRAMES = 50
+# Default number of pedestrians answered by /query/neighbors
+NEIGHBORS = 5
+# Number of processes rendering plots, defaults to the number of cores
+RENDER_WORKERS = int(os.environ.get('JPSVIS_RENDER_WORKERS', os.cpu_count() or 1))
+# Largest accepted upload in bytes
+MAX_UPLOAD_BYTES = int(os.environ.get('JPSVIS_MAX_UPLOAD_BYTES', 8 * 1024 ** 3))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Bytes read to identify an upload before it is stored
+UPLOAD_SNIFF_BYTES = 64 * 1024
+XML_COMMENT = re.compile(rb'<!--.*?-->', re.S)
+# First element, '<?xml' and '<!DOCTYPE' don't start with a letter
+XML_ROOT_TAG = re.compile(rb'<([A-Za-z_][\w.-]*)')
+
+
+def frame_window(request, traj):
+    """ Read the ?frame=F or ?from=F0&to=F1 query, (None, None) if absent
+
+    A missing from/to defaults to the first/last frame of the trajectory.
+    """
+    query = request.query
+    try:
+        if 'frame' in query:
+            frame = int(query['frame'])
+            return frame, frame
+        if 'from' in query or 'to' in query:
+            first, last = traj.frame_range()
+            first = int(query['from']) if 'from' in query else first
+            last = int(query['to']) if 'to' in query else last
+            return first, last
+    except ValueError:
+        raise web.HTTPBadRequest(text='frame, from and to must be integers')
+    return None, None
+
+
+def lod_params(request, traj):
+    """ Read the level of detail query: ?stride=N or ?fps=F, and ?quantize=MM
+
+    fps is turned into the stride closest to it, quantize is the
+    coordinate resolution in millimetres.
+
+    :returns: (frame stride, quantization step in metres or None)
+    """
+    query = request.query
+    try:
+        stride = int(query.get('stride', 1))
+        fps = float(query['fps']) if 'fps' in query else None
+        step = float(query['quantize']) / 1000 if 'quantize' in query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text='stride, fps and quantize must be numbers')
+    if stride < 1 or (fps is not None and not fps > 0) or (step is not None and not step > 0):
+        raise web.HTTPBadRequest(text='stride, fps and quantize must be positive')
+
+    if fps is not None:
+        if traj.framerate is None:
+            raise web.HTTPBadRequest(text='fps needs a trajectory with framerate')
+        # Every frame for fps above the framerate
+        stride = int(round(traj.framerate / fps)) or 1
+    return stride, step
 
 
-def parse_geometry_file(filepath):
-    if filepath:
-        with open(filepath, encoding='utf-8') as f:
-            return xmltodict.parse(f.read(), attr_prefix='')
-    else:
-        return None
-
-
-def parse_trajectory_file(filepath):
-    trajectory = {'pedestrians': []}
-    if filepath:
-        with open(filepath, 'r') as f:
-            for line in f.readlines():
-                line = line.strip('\n')
-                if line.startswith('#framerate:'):
-                    framerate = float(line.split()[1])
-                    trajectory['framerate'] = framerate
-                else:
-                    if line.startswith('#') is False and line != '':
-                        line = line.split('\t')
-                        id = int(line[0])
-                        if id < len(trajectory['pedestrians']) + 1:
-                            trajectory['pedestrians'][id - 1].append(parse_pedestrian(line))
-                        else:
-                            trajectory['pedestrians'].append([parse_pedestrian(line)])
-
-        return trajectory
+async def index(request):
+    # Avoid web.FileResponse here because we want to disable caching.
+    html = open(str(PROJ_ROOT / 'static' / 'index.html')).read()
+    return web.Response(text=html, content_type='text/html', headers=NO_CACHE_HEADER)
 
-    else:
-        return None
 
+def request_workspace(request):
+    """ Workspace of the ?dataset=ID query, the default workspace without it """
+    try:
+        return request.app['workspaces'].get(request.query.get('dataset'))
+    except KeyError:
+        raise web.HTTPNotFound(text='unknown dataset')
 
-def parse_pedestrian(dataline):
-    id = dataline[0]
-    x = float(dataline[2])
-    y = float(dataline[3])
-    z = float(dataline[4])
-    a = float(dataline[5])
-    b = float(dataline[6])
-    angle = float(dataline[7])
-    color = float(dataline[8])
 
-    location = {
-        'coordinate': {'x': x, 'y': y, 'z': z},
-        'axes': {'A': a, 'B': b},
-        'angle': angle,
-        'color': color,
-        'id': id
-    }
+# Wait until <filepaths> are ingested, then return their content hashes.
+# Files not in the cache yet (e.g. of the default workspace, or whose
+# ingestion failed) are hashed and parsed in the render workers, so
+# handlers can ingest.load them without blocking the event loop.
+async def ingested(request, *filepaths):
+    hashes = {}
+    for filepath in filepaths:
+        pending = request.app['ingestion'].get(filepath)
+        if pending is None:
+            kind = ingest.FILE_KINDS[os.path.basename(filepath)]
+            digest = ingest.known_hash(filepath)
+            if ingest.is_ingested(kind, digest):
+                hashes[filepath] = digest
+                continue
+            pending = start_ingestion(request.app, kind, filepath)
+        hashes[filepath] = await asyncio.shield(pending)
+    return hashes
 
-    return location
 
+def base64_requested(request):
+    # The view page shows plots as base64 data URLs
+    return request.query.get('format') == 'base64'
+
+
+def etag_matches(request, etag):
+    """ Whether the If-None-Match header of the request covers <etag> """
+    header = request.headers.get('If-None-Match')
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+def plot_etag(keys, encoding=''):
+    """ Strong ETag of a plot response, derived from its render cache keys
+
+    :param encoding: suffix telling representations of the same plots apart
+    """
+    tag = keys[0] if len(keys) == 1 else hashlib.sha1(''.join(keys).encode('utf-8')).hexdigest()
+    return '"{}{}"'.format(tag, encoding)
+
+
+def not_modified(etag):
+    return web.Response(status=304, headers=dict(NO_CACHE_HEADER, ETag=etag))
 
-async def index(request):
-    # Avoid web.FileResponse here because we want to disable caching.
-    html = open(str(PROJ_ROOT / 'static' / 'index.html')).read()
-    return web.Response(text=html, content_type='text/html', headers=NO_CACHE_HEADER)
+
+def png_response(request, path, etag):
+    # Clients must revalidate, the same URL shows new content after an upload
+    headers = dict(NO_CACHE_HEADER, ETag=etag)
+    with open(path, "rb") as img_f:
+        if base64_requested(request):
+            return web.Response(text=base64.b64encode(img_f.read()).decode('utf-8'), headers=headers)
+        return web.Response(body=img_f.read(), content_type='image/png', headers=headers)
+
+
+# Answer a plot request from the render cache: 304 if the client has the
+# current version, else the png (or its base64 text with ?format=base64).
+# <kinds> are rendered together by <plot>, the one at <index> is returned.
+async def plot_response(request, kinds, index, inputs, params, plot, *args):
+    etag = plot_etag([render.render_key(kinds[index], inputs, params)],
+                     '-base64' if base64_requested(request) else '')
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    paths = await request_workspace(request).render_cache.render(kinds, inputs, params, plot, *args)
+    return png_response(request, paths[index], etag)
 
 
 # Handler for request "/N_t"
 async def get_Nt(request):
-    nt_file = 'N_t.dat'
-    _Plot_N_t.plot_Nt(nt_file)
+    nt_file = request_workspace(request).path('N_t.dat')
+    inputs = await ingested(request, nt_file)
+    return await plot_response(request, ['N_t'], 0, inputs, {}, plots.render_Nt, nt_file)
 
-    with open("N_t.png", "rb") as img_f:
-        return web.Response(text=base64.b64encode(img_f.read()).decode('utf-8'))
 
+def profile_params(request):
+    """ Read the ?from=F0&to=F1&dx=&dy= query of the profiles """
+    query = request.query
+    try:
+        params = {
+            'from': int(query['from']) if 'from' in query else None,
+            'to': int(query['to']) if 'to' in query else None,
+            'dx': float(query.get('dx', plot_profiles.DEFAULT_GRID_SIZE)),
+            'dy': float(query.get('dy', plot_profiles.DEFAULT_GRID_SIZE)),
+        }
+    except ValueError:
+        raise web.HTTPBadRequest(text='from and to must be integers, dx and dy numbers')
+    if not (params['dx'] > 0 and params['dy'] > 0):
+        raise web.HTTPBadRequest(text='dx and dy must be positive')
+    return params
+
+
+def check_profile_grid(geofile, params):
+    """ 400 for a profile grid too fine for the geometry, see plot_profiles.MAX_PROFILE_CELLS """
+    try:
+        limits = ingest.load('geometry', geofile).bounds()
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    if plot_profiles.grid_cells(limits, params['dx'], params['dy']) > plot_profiles.MAX_PROFILE_CELLS:
+        raise web.HTTPBadRequest(text='the profile grid has more than {} cells, use a larger dx or dy'.format(
+            plot_profiles.MAX_PROFILE_CELLS))
 
-# Handler for request "/Profiles_Density"
-async def get_profile_density(request):
-    geofile = 'geometry.xml'
-    trafile = 'trajectory.txt'
-    IFDfile = 'IFD.dat'
 
-    if not os.path.exists("profile_density.png"):
-        plot_profiles.plot_profiles(geofile, trafile, IFDfile)
+# Density and velocity profiles are rendered together
+async def profile_response(request, index):
+    workspace = request_workspace(request)
+    geofile = workspace.path('geometry.xml')
+    IFDfile = workspace.path('IFD.dat')
+    params = profile_params(request)
+    inputs = await ingested(request, geofile, IFDfile)
+    check_profile_grid(geofile, params)
 
-    with open("profile_density.png", "rb") as img_f:
-        return web.Response(text=base64.b64encode(img_f.read()).decode('utf-8'))
+    return await plot_response(
+        request, ['profile_density', 'profile_velocity'], index, inputs, params,
+        plots.render_profiles, geofile, IFDfile, params['from'], params['to'], params['dx'], params['dy'])
 
 
-async def get_profile_velocity(request):
-    geofile = 'geometry.xml'
-    trafile = 'trajectory.txt'
-    IFDfile = 'IFD.dat'
+# Handler for request "/Profiles_Density", takes ?from=F0&to=F1&dx=&dy=
+async def get_profile_density(request):
+    return await profile_response(request, 0)
 
-    if not os.path.exists("profile_velocity.png"):
-        plot_profiles.plot_profiles(geofile, trafile, IFDfile)
 
-    with open("profile_velocity.png", "rb") as img_f:
-        return web.Response(text=base64.b64encode(img_f.read()).decode('utf-8'))
+async def get_profile_velocity(request):
+    return await profile_response(request, 1)
 
 
-async def get_density_frame(request):
-    rho_v_file = 'rho_v.dat'
+async def FD_response(request, kind):
+    rho_v_file = request_workspace(request).path('rho_v.dat')
+    inputs = await ingested(request, rho_v_file)
+    return await plot_response(request, [kind], 0, inputs, {}, plots.render_FD, kind, rho_v_file)
 
-    if not os.path.exists("density_frame.png"):
-        plot_FD.plot_density_frame(rho_v_file)
 
-    with open("density_frame.png", "rb") as img_f:
-        return web.Response(text=base64.b64encode(img_f.read()).decode('utf-8'))
+async def get_density_frame(request):
+    return await FD_response(request, 'density_frame')
 
 
 async def get_velocity_frame(request):
-    rho_v_file = 'rho_v.dat'
-
-    if not os.path.exists("velocity_frame.png"):
-        plot_FD.plot_velocity_frame(rho_v_file)
-
-    with open("velocity_frame.png", "rb") as img_f:
-        return web.Response(text=base64.b64encode(img_f.read()).decode('utf-8'))
+    return await FD_response(request, 'velocity_frame')
 
 
 async def get_density_velocity(request):
-    rho_v_file = 'rho_v.dat'
+    return await FD_response(request, 'density_velocity')
 
-    if not os.path.exists("density_velocity.png"):
-        plot_FD.plot_density_velocity(rho_v_file)
 
-    with open("density_velocity.png", "rb") as img_f:
-        return web.Response(text=base64.b64encode(img_f.read()).decode('utf-8'))
+async def get_density_J(request):
+    return await FD_response(request, 'density_J')
 
 
-async def get_density_J(request):
-    rho_v_file = 'rho_v.dat'
+# Routes of the fundamental diagrams and their plot kinds
+FD_ROUTES = {
+    'Density_Time': 'density_frame',
+    'Velocity_Time': 'velocity_frame',
+    'Density_Velocity': 'density_velocity',
+    'Density_Flow': 'density_J',
+}
+
+
+# Handler for request "/FD_all"
+# Renders the four fundamental diagrams in parallel render workers, all
+# reading the one parsed rho_v array of the ingestion cache, and answers
+# {route: base64 png} for the routes of FD_ROUTES
+async def get_FD_all(request):
+    workspace = request_workspace(request)
+    rho_v_file = workspace.path('rho_v.dat')
+    inputs = await ingested(request, rho_v_file)
+    etag = plot_etag([render.render_key(kind, inputs) for kind in FD_ROUTES.values()])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    cache = workspace.render_cache
+    pngs = await asyncio.gather(*[cache.render([kind], inputs, {}, plots.render_FD, kind, rho_v_file)
+                                  for kind in FD_ROUTES.values()])
+
+    images = {}
+    for route, (png,) in zip(FD_ROUTES, pngs):
+        with open(png, "rb") as img_f:
+            images[route] = base64.b64encode(img_f.read()).decode('utf-8')
+    return web.Response(text=json.dumps(images), content_type='application/json',
+                        headers=dict(NO_CACHE_HEADER, ETag=etag))
+
+
+# Answer a data request as JSON, 304 if the client has the current version.
+# compute() is a coroutine function returning the JSON serializable data.
+async def data_response(request, kind, inputs, params, compute):
+    etag = '"{}"'.format(render.render_key(kind, inputs, params))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    data = await compute()
+    return web.Response(text=json.dumps(data), content_type='application/json',
+                        headers=dict(NO_CACHE_HEADER, ETag=etag))
+
+
+# Run a job of plots.py in the render workers
+async def run_in_worker(request, job, *args):
+    executor = request.app['workspaces'].executor
+    return await asyncio.get_event_loop().run_in_executor(executor, functools.partial(job, *args))
+
+
+# Handler for request "/data/N_t": {"time": [...], "N": [...]}
+async def get_Nt_data(request):
+    nt_file = request_workspace(request).path('N_t.dat')
+
+    async def compute():
+        data = ingest.load('N_t', nt_file)
+        return {'time': data[:, 0].tolist(), 'N': data[:, 1].tolist()}
+
+    inputs = await ingested(request, nt_file)
+    return await data_response(request, 'data_N_t', inputs, {}, compute)
+
+
+# Handler for request "/data/rho_v": the series behind the fundamental diagrams,
+# {"from", "to", "frame": [...], "density": [...], "velocity": [...]}
+async def get_rho_v_data(request):
+    rho_v_file = request_workspace(request).path('rho_v.dat')
+
+    async def compute():
+        data, fmin, fmax = plot_FD.read_rho_v(rho_v_file, ingest.load('rho_v', rho_v_file))
+        return {
+            'from': fmin,
+            'to': fmax,
+            'frame': data[:, 0].astype(int).tolist(),
+            'density': data[:, 1].tolist(),
+            'velocity': data[:, 2].tolist(),
+        }
+
+    inputs = await ingested(request, rho_v_file)
+    return await data_response(request, 'data_rho_v', inputs, {}, compute)
+
+
+# Handler for request "/data/profiles", takes ?from=F0&to=F1&dx=&dy= like "/Profiles_Density"
+# and answers the matrices of both profiles, see plots.profile_data
+async def get_profile_data(request):
+    workspace = request_workspace(request)
+    geofile = workspace.path('geometry.xml')
+    IFDfile = workspace.path('IFD.dat')
+    params = profile_params(request)
+
+    async def compute():
+        return await run_in_worker(request, plots.profile_data, geofile, IFDfile,
+                                   params['from'], params['to'], params['dx'], params['dy'])
+
+    inputs = await ingested(request, geofile, IFDfile)
+    check_profile_grid(geofile, params)
+    return await data_response(request, 'data_profiles', inputs, params, compute)
+
 
-    if not os.path.exists("density_J.png"):
-        plot_FD.plot_density_J(rho_v_file)
+def numbers_param(request, name):
+    """ Comma separated numbers of the ?<name>= query, e.g. bbox=0,0,10,5 """
+    try:
+        return [float(value) for value in request.query[name].split(',')]
+    except ValueError:
+        raise web.HTTPBadRequest(text='{} must be comma separated numbers'.format(name))
+
+
+# Handler for request "/query/region": the pedestrians inside a rectangle
+# "bbox=xmin,ymin,xmax,ymax" or a polygon "polygon=x1,y1,x2,y2,..." within the
+# frame window of "/trajectory" (all frames without one), see plots.query_region
+async def get_region_query(request):
+    tra_file = request_workspace(request).path('trajectory.txt')
+    inputs = await ingested(request, tra_file)
+    first, last = frame_window(request, ingest.load('trajectory', tra_file))
+    params = {'from': first, 'to': last}
+    if 'polygon' in request.query:
+        polygon = numbers_param(request, 'polygon')
+        if len(polygon) < 6 or len(polygon) % 2:
+            raise web.HTTPBadRequest(text='polygon needs at least three x,y vertices')
+        params['polygon'] = polygon
+    elif 'bbox' in request.query:
+        bbox = numbers_param(request, 'bbox')
+        if len(bbox) != 4:
+            raise web.HTTPBadRequest(text='bbox must be xmin,ymin,xmax,ymax')
+        params['bbox'] = bbox
+    else:
+        raise web.HTTPBadRequest(text='bbox or polygon required')
+
+    async def compute():
+        rectangle = None
+        if 'bbox' in params:
+            xmin, ymin, xmax, ymax = params['bbox']
+            rectangle = (xmin, xmax, ymin, ymax)
+        data = await run_in_worker(request, plots.query_region, tra_file, first, last,
+                                   rectangle, params.get('polygon'))
+        return dict(params, **data)
+
+    return await data_response(request, 'query_region', inputs, params, compute)
+
+
+# Handler for request "/query/neighbors?frame=F&id=I&k=K": the K (default
+# NEIGHBORS) pedestrians closest to pedestrian I, or to the point "x=&y=",
+# in frame F, see plots.query_neighbors
+async def get_neighbors_query(request):
+    tra_file = request_workspace(request).path('trajectory.txt')
+    inputs = await ingested(request, tra_file)
+    query = request.query
+    try:
+        params = {'frame': int(query['frame']), 'k': int(query.get('k', NEIGHBORS))}
+        if 'id' in query:
+            params['id'] = int(query['id'])
+        else:
+            params['x'], params['y'] = float(query['x']), float(query['y'])
+    except KeyError:
+        raise web.HTTPBadRequest(text='frame and either id or x and y required')
+    except ValueError:
+        raise web.HTTPBadRequest(text='frame, id, k, x and y must be numbers')
+    if params['k'] < 1:
+        raise web.HTTPBadRequest(text='k must be positive')
+
+    async def compute():
+        try:
+            data = await run_in_worker(request, plots.query_neighbors, tra_file, params['frame'], params['k'],
+                                       params.get('id'), params.get('x'), params.get('y'))
+        except KeyError as e:
+            raise web.HTTPNotFound(text=e.args[0])
+        return dict(params, **data)
+
+    return await data_response(request, 'query_neighbors', inputs, params, compute)
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Compress a document in the render workers, concurrent requests for the
+# same document share the job
+async def encode_document(app, kind, filepath, digest, encoding):
+    path = precompressed.document_path(kind, digest, encoding)
+    pending = app['encoding'].get(path)
+    if pending is None:
+        pending = asyncio.get_event_loop().run_in_executor(
+            app['workspaces'].executor,
+            functools.partial(precompressed.encode_document, kind, filepath, digest, encoding))
+        app['encoding'][path] = pending
+        pending.add_done_callback(lambda _: app['encoding'].pop(path, None))
+    return await asyncio.shield(pending)
+
+
+# Answer a request for the full document of an input file from the cache.
+# Clients that accept gzip or br get it precompressed, others the cached
+# uncompressed document, so the JSON is never built on the event loop.
+async def document_response(request, kind, filepath):
+    digest = (await ingested(request, filepath))[filepath]
+    encoding = precompressed.negotiate(request.headers.get('Accept-Encoding', ''))
+    etag = '"{}-{}"'.format(digest, encoding or 'identity')
+    headers = dict(NO_CACHE_HEADER, ETag=etag, Vary='Accept-Encoding')
+    if etag_matches(request, etag):
+        return web.Response(status=304, headers=headers)
+
+    path = precompressed.document_path(kind, digest, encoding or 'identity')
+    if not os.path.exists(path):
+        path = await encode_document(request.app, kind, filepath, digest, encoding or 'identity')
+    body = await asyncio.get_event_loop().run_in_executor(None, read_file, path)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return web.Response(body=body, content_type='text/plain', charset='utf-8', headers=headers)
+
+
+# Handler for request "/geometry"
+async def get_geometry(request):
+    return await document_response(request, 'geometry', request_workspace(request).path('geometry.xml'))
 
-    with open("density_J.png", "rb") as img_f:
-        return web.Response(text=base64.b64encode(img_f.read()).decode('utf-8'))
 
+# Write the frames within [first, last] as NDJSON: a header line with
+# framerate/from/to, then one {"frame", "locations"} object per line.
+# Every write waits for the transport to drain, so a slow client
+# throttles serialization instead of growing the send buffer.
+async def stream_trajectory(request, traj, first, last, stride=1):
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
 
-async def get_geometry(request):
-    geo_file = 'geometry.xml'
-    return web.Response(text=json.dumps(parse_geometry_file(geo_file), ensure_ascii=False))
+    await response.write((json.dumps(traj.window_header(first, last, stride)) + '\n').encode('utf-8'))
+    for batch in traj.iter_frames(first, last, STREAM_BATCH_FRAMES, stride):
+        lines = ''.join(json.dumps(frame, ensure_ascii=False) + '\n' for frame in batch)
+        await response.write(lines.encode('utf-8'))
+
+    await response.write_eof()
+    return response
 
 
+# Handler for request "/trajectory", "/trajectory?frame=F" and "/trajectory?from=F0&to=F1"
+# Add "stream=1" to receive the frames as a streamed NDJSON response.
+# "stride=N" or "fps=F" skip frames for overview playback, see lod_params.
+# The full trajectory is served precompressed, see document_response.
 async def get_trajectory(request):
-    tra_file = 'trajectory.txt'
-    return web.Response(text=json.dumps(parse_trajectory_file(tra_file), ensure_ascii=False))
+    tra_file = request_workspace(request).path('trajectory.txt')
+    await ingested(request, tra_file)
+    traj = ingest.load('trajectory', tra_file)
+    first, last = frame_window(request, traj)
+    stride, step = lod_params(request, traj)
+    if step is not None:
+        raise web.HTTPBadRequest(text='quantize is only supported by /trajectory.bin')
+    if request.query.get('stream', '0') not in ('0', 'false'):
+        if first is None:
+            first, last = traj.frame_range()
+        return await stream_trajectory(request, traj, first, last, stride)
+    if first is None:
+        if stride == 1:
+            return await document_response(request, 'trajectory', tra_file)
+        body = await run_in_worker(request, plots.trajectory_overview, tra_file, stride)
+        return web.Response(body=body, content_type='text/plain', charset='utf-8')
+    return web.Response(text=json.dumps(traj.to_frames_dict(first, last, stride), ensure_ascii=False))
+
+
+# Handler for request "/trajectory.bin", takes the same frame window as "/trajectory"
+# and the level of detail of lod_params: "stride=N" or "fps=F" skip frames,
+# "quantize=MM" sends coordinates as int16/int32 differences in MM millimetres
+# (layout version 2). Encoding runs in the render workers, the whole
+# trajectory is encoded once per level of detail and cached.
+async def get_trajectory_bin(request):
+    tra_file = request_workspace(request).path('trajectory.txt')
+    await ingested(request, tra_file)
+    traj = ingest.load('trajectory', tra_file)
+    first, last = frame_window(request, traj)
+    stride, step = lod_params(request, traj)
+    try:
+        body = await run_in_worker(request, plots.trajectory_lod, tra_file, first, last, stride, step)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    return web.Response(body=body, content_type='application/octet-stream')
+
+
+# Send the messages of a live subscription until it is dropped
+async def send_live(ws, queue):
+    while True:
+        message = await queue.get()
+        if message is None:
+            await ws.close(message=b'too slow')
+            return
+        await ws.send_str(message)
+
+
+# Handler for the WebSocket "/trajectory/live": follows trajectory.txt while a
+# simulation still writes it, see live.py for the messages. The frames read so
+# far come first, with "since=F" only those after frame F.
+async def get_live_trajectory(request):
+    tra_file = request_workspace(request).path('trajectory.txt')
+    try:
+        since = int(request.query['since']) if 'since' in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text='since must be an integer')
+
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    following = request.app['live'].get(tra_file)
+    # Read the whole file first, it is sent directly rather than through the
+    # bounded queue. The backlog is taken right when subscribing, frames
+    # appended afterwards are published to the queue.
+    await following.catch_up()
+    queue = following.subscribe()
+    try:
+        traj = following.tail.trajectory
+        first, last = traj.frame_range()
+        if since is not None:
+            first = since + 1
+        for message in live.frames_messages(traj, first, last):
+            await ws.send_str(message)
+
+        sender = asyncio.ensure_future(send_live(ws, queue))
+        # Viewers send nothing, reading only notices when they leave
+        async for _ in ws:
+            pass
+        sender.cancel()
+    finally:
+        following.unsubscribe(queue)
+    return ws
+
+
+# Send playback batches whenever the viewer's window allows, see playback.py
+async def send_playback(ws, player, changed):
+    while True:
+        while not player.ready():
+            changed.clear()
+            await changed.wait()
+        batch, end = player.next()
+        if batch is not None:
+            await ws.send_bytes(batch)
+        if end:
+            await ws.send_str(json.dumps({'type': 'end'}))
+
+
+# Handler for the WebSocket "/trajectory/play": frame batches paced by the
+# viewer's acknowledgements, see playback.py. "quantize=MM" sends the batches
+# in the quantized layout of "/trajectory.bin".
+async def get_playback(request):
+    tra_file = request_workspace(request).path('trajectory.txt')
+    await ingested(request, tra_file)
+    traj = ingest.load('trajectory', tra_file)
+    stride, step = lod_params(request, traj)
+    if stride != 1:
+        raise web.HTTPBadRequest(text='playback sends every frame, use rate instead of stride or fps')
+    if step is not None:
+        try:
+            traj.check_quantization(step)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    player = playback.Playback(traj, step)
+    changed = asyncio.Event()
+    await ws.send_str(player.header())
+    sender = asyncio.ensure_future(send_playback(ws, player, changed))
+    try:
+        async for msg in ws:
+            if msg.type != web.WSMsgType.TEXT:
+                continue
+            try:
+                answer = player.control(json.loads(msg.data))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                await ws.send_str(json.dumps({'type': 'error', 'message': str(e)}))
+                continue
+            if answer is not None:
+                await ws.send_str(answer)
+            changed.set()
+    finally:
+        sender.cancel()
+    return ws
+
+
+def upload_target(filename, head):
+    """ Identify an upload from its name and first bytes
+
+    :returns: (file name in the workspace, ingestion kind or None),
+              (None, None) for rejected uploads
+    """
+    namestrings = filename.split("_")
+
+    if filename.endswith('.xml'):
+        # Root tag, after the XML declaration and comments
+        root = XML_ROOT_TAG.search(XML_COMMENT.sub(b'', head))
+        root = root.group(1).decode('utf-8', 'replace') if root else None
+        if root == 'geometry':  # geometry file
+            return 'geometry.xml', 'geometry'
+        elif root == 'JPSreport':  # JPSreport ini file
+            return 'JPSreport_ini.xml', None
+    elif filename.endswith('.txt'):  # Trajectory file
+        firstline = head.split(b'\n', 1)[0]
+        if firstline.startswith(b'#description'):
+            return 'trajectory.txt', 'trajectory'
+        elif firstline.startswith(b'#Simulation'):
+            return 'flow_{id}.txt'.format(id=namestrings[3]), None
+        return filename, None
+    elif filename.endswith('.dat'):  # outputs file
+        if namestrings[0] == 'rho':
+            if namestrings[1] == 'v':
+                return 'rho_v.dat', 'rho_v'
+        elif namestrings[1] == 'NT':
+            return 'N_t.dat', 'N_t'
+        elif namestrings[0] == 'IFD':
+            return 'IFD.dat', 'IFD'
+        return filename, None
+
+    return None, None
+
+
+# Write chunks to <f> and hash them, runs in a thread
+def write_chunk(f, sha, chunk):
+    f.write(chunk)
+    sha.update(chunk)
+
+
+async def part_chunks(file):
+    """ Chunks of a multipart body part """
+    while True:
+        chunk = await file.read_chunk(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def store_chunks(workspace, chunks):
+    """ Write <chunks> to a temporary file of the workspace
+
+    Disk writes run in a thread, hashing happens on the way.
+
+    :returns: (temporary path, SHA-1 of the content)
+    :raises HTTPRequestEntityTooLarge: beyond MAX_UPLOAD_BYTES, nothing is left on disk
+    """
+    loop = asyncio.get_event_loop()
+    tmp = workspace.path('.upload-{}'.format(uuid.uuid4().hex))
+    f = await loop.run_in_executor(None, open, tmp, 'wb')
+    sha = hashlib.sha1()
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise web.HTTPRequestEntityTooLarge(MAX_UPLOAD_BYTES, size)
+            await loop.run_in_executor(None, write_chunk, f, sha, chunk)
+        await loop.run_in_executor(None, f.close)
+    except BaseException:
+        f.close()
+        os.remove(tmp)
+        raise
+    return tmp, sha.hexdigest()
+
+
+async def prepend(head, chunks):
+    yield head
+    async for chunk in chunks:
+        yield chunk
+
+
+# Receive a plain upload into <workspace>, see upload_target.
+# The type is known from the first bytes, so rejected uploads are not stored.
+async def receive_upload(workspace, chunks, filename):
+    head = b''
+    async for chunk in chunks:
+        head += chunk
+        if len(head) >= UPLOAD_SNIFF_BYTES:
+            break
+
+    target, kind = upload_target(filename, head)
+    if target is None:
+        await chunks.aclose()
+        return None, None, None
+
+    tmp, digest = await store_chunks(workspace, prepend(head, chunks))
+    path = workspace.path(target)
+    os.replace(tmp, path)
+    return path, kind, digest
+
+
+# Receive the members of a zip archive, e.g. geometry, trajectory and the
+# JPSreport outputs of one run. The directory of a zip is at its end, so
+# the archive is stored first and removed once its members are read.
+async def receive_zip(app, workspace, chunks):
+    tmp, _ = await store_chunks(workspace, chunks)
+    try:
+        members = await asyncio.get_event_loop().run_in_executor(None, archives.zip_members, tmp)
+        results = {}
+        for name in members:
+            member = os.path.basename(name)
+            if member.lower().endswith('.zip'):
+                results[member] = False
+            else:
+                results.update(await receive_file(app, workspace, archives.zip_member_chunks(tmp, name), member))
+        return results
+    finally:
+        os.remove(tmp)
+
+
+async def receive_file(app, workspace, chunks, filename):
+    """ Receive an upload, decompressing .gz/.xz and unpacking .zip on the way
+
+    Recognized files are stored under their name in the workspace and
+    ingested in the background.
+
+    :returns: {file name: whether it was accepted}
+    """
+    suffix = archives.compression(filename)
+    if suffix is not None:
+        return await receive_file(app, workspace, archives.decompress(chunks, suffix),
+                                  filename[:-len(suffix)])
+    if filename.lower().endswith('.zip'):
+        return await receive_zip(app, workspace, chunks)
+
+    path, kind, digest = await receive_upload(workspace, chunks, filename)
+    if path is not None and kind is not None:
+        ingest_upload(app, workspace, kind, path, digest)
+    return {filename: path is not None}
+
+
+# Parse a file into the cache in a worker process. Requests for the file
+# wait for the job (see ingested) and share it.
+# :returns: task resolving to the content hash of the file
+def start_ingestion(app, kind, filepath, digest=None):
+    async def run():
+        try:
+            result = await asyncio.get_event_loop().run_in_executor(
+                app['workspaces'].executor, ingest.ingest, kind, filepath, digest)
+        except Exception:
+            logging.exception('ingesting %s failed', filepath)
+            raise
+        ingest.remember_hash(filepath, result)
+        return result
+
+    def done(task):
+        if pending.get(filepath) is task:
+            pending.pop(filepath)
+        # Failures are logged, requests waiting for the file get them as well
+        if not task.cancelled():
+            task.exception()
+
+    pending = app['ingestion']
+    task = asyncio.ensure_future(run())
+    pending[filepath] = task
+    task.add_done_callback(done)
+    return task
+
+
+# Ingest an uploaded file, the upload itself does not wait for it
+def ingest_upload(app, workspace, kind, filepath, digest):
+    ingest.remember_hash(filepath, digest)
+    # Drop plots of the previous content
+    workspace.render_cache.invalidate(filepath, digest)
+    start_ingestion(app, kind, filepath, digest)
 
 
 # Upload request handler
+# "/upload" stores the file in a new dataset, "/upload?dataset=ID" adds it
+# to an existing one. The response names the dataset for later requests.
+# .gz, .xz and .zip uploads are unpacked, a zip may bundle all files of a run.
 async def post_file(request):
+    workspaces = request.app['workspaces']
+    # Dataset created by this upload, removed again unless a file is accepted
+    created = None
+    accepted = False
     try:
+        if 'dataset' in request.query:
+            workspace = request_workspace(request)
+        else:
+            workspace = created = workspaces.create()
+
         reader = await request.multipart()
         file = await reader.next()
-        filename = file.filename if file.filename else 'undefined'
-
-        print('here: ', filename, os.getcwd())
-
-        size = 0
-        with open(filename, 'wb') as f:
-            while True:
-                chunk = await file.read_chunk()
-                if not chunk:
-                    break
-                size += len(chunk)
-                f.write(chunk)
-
-            f.close()
-
-            # Identify the file format
-            # Rename according to the file format
-            namestrings = filename.split("_")
-
-            if filename.endswith('.xml'):
-                tree = ET.parse(filename)
-                root = tree.getroot()
-
-                if root.tag == 'geometry':  # geometry file
-                    os.rename(filename, 'geometry.xml')
-                    text = {'res': '200'}
-                elif root.tag == 'JPSreport':  # JPSreport ini file
-                    os.rename(filename, 'JPSreport_ini.xml')
-                    text = {'res': '200'}
-
-                else:
-                    os.remove(filename)
-                    text = {'res': '500'}
-            elif filename.endswith('.txt'):  # Trajectory file
-                with open(filename, 'r') as f:
-                    firstline = f.readline()
-                    if firstline.startswith('#description'):
-                        os.rename(filename, 'trajectory.txt')
-                    elif firstline.startswith('#Simulation'):
-                        os.rename(filename, 'flow_{id}.txt'.format(id=namestrings[3]))
-
-                text = {'res': '200'}
-            elif filename.endswith('.dat'):  # outputs file
-                if namestrings[0] == 'rho':
-                    if namestrings[1] == 'v':
-                        os.rename(filename, 'rho_v.dat')
-                elif namestrings[1] == 'NT':
-                    os.rename(filename, 'N_t.dat')
-                elif namestrings[0] == 'IFD':
-                    os.rename(filename, 'IFD.dat')
-
-                text = {'res': '200'}
-            else:
-                text = {'res': '500'}
-
-            return web.Response(text=json.dumps(text, ensure_ascii=False))  # Response to Dragger component
-
+        # Never write outside of the dataset directory
+        filename = os.path.basename(file.filename) if file.filename else 'undefined'
+
+        print('here: ', workspace.path(filename))
+
+        files = await receive_file(request.app, workspace, part_chunks(file), filename)
+        accepted = True in files.values()
+        text = {'res': '200' if accepted else '500'}
+        if accepted or created is None:
+            text['dataset'] = workspace.id
+        if len(files) > 1 or filename not in files:
+            # Members of archives
+            text['files'] = files
+        return web.Response(text=json.dumps(text, ensure_ascii=False))  # Response to Dragger component
+
+    except web.HTTPException:
+        raise
     except Exception as e:
         print(e)
         return web.Response(text="500")  # Response to Dragger component
+    finally:
+        if created is not None and not accepted:
+            workspaces.remove(created)
+
+
+async def shutdown_render_pool(app):
+    app['live'].stop()
+    app['workspaces'].shutdown()
 
 
-def setup_server():
+def setup_server(render_workers=RENDER_WORKERS):
     app = web.Application()
+    # Plots render in worker processes, keeping the event loop free for
+    # uploads and trajectory requests
+    app['workspaces'] = datasets.Workspaces(executor=ProcessPoolExecutor(render_workers))
+    # Background ingestion of uploads, {file path: task}
+    app['ingestion'] = {}
+    # Documents being compressed, {cache path: future}
+    app['encoding'] = {}
+    # Trajectories followed for "/trajectory/live"
+    app['live'] = live.LiveTrajectories()
+    app.on_cleanup.append(shutdown_render_pool)
     # aiohttp_debugtoolbar.setup(app)
 
     # Add CORS implementation for /upload
@@ -279,6 +912,9 @@ def setup_server():
     app.router.add_get("/ViewPage", index)
     app.router.add_get("/geometry", get_geometry)
     app.router.add_get("/trajectory", get_trajectory)
+    app.router.add_get("/trajectory.bin", get_trajectory_bin)
+    app.router.add_get("/trajectory/live", get_live_trajectory)
+    app.router.add_get("/trajectory/play", get_playback)
     app.router.add_get("/N_t", get_Nt)
     app.router.add_get("/Profiles_Density", get_profile_density)
     app.router.add_get("/Profiles_Velocity", get_profile_velocity)
@@ -286,6 +922,12 @@ def setup_server():
     app.router.add_get("/Velocity_Time", get_velocity_frame)
     app.router.add_get("/Density_Velocity", get_density_velocity)
     app.router.add_get("/Density_Flow", get_density_J)
+    app.router.add_get("/FD_all", get_FD_all)
+    app.router.add_get("/data/N_t", get_Nt_data)
+    app.router.add_get("/data/rho_v", get_rho_v_data)
+    app.router.add_get("/data/profiles", get_profile_data)
+    app.router.add_get("/query/region", get_region_query)
+    app.router.add_get("/query/neighbors", get_neighbors_query)
     app.router.add_static('/', path=str(PROJ_ROOT / 'static'))
 
     return app
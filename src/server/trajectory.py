@@ -0,0 +1,517 @@
+#  \file trajectory.py
+#  \date 2026 - 10 - 18
+#  \copyright <2009 - 2020> Forschungszentrum Jülich GmbH. All rights reserved.
+#
+#  \section License
+#  This file is part of JuPedSim.
+#
+#  JuPedSim is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#   any later version.
+#
+#  JuPedSim is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with JuPedSim. If not, see <http://www.gnu.org/licenses/>.
+import io
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+# Columns of a JuPedSim trajectory file, in file order
+COLUMNS = ['id', 'frame', 'x', 'y', 'z', 'A', 'B', 'angle', 'color']
+INT_COLUMNS = ['id', 'frame']
+
+# Binary layout served by /trajectory.bin (all little-endian):
+#   magic 'JPST', uint32 version, float32 framerate (NaN if unknown),
+#   uint32 rows, uint32 frames, uint32 pedestrians, uint32 column count,
+#   uint32 byte offset of every column, then the column buffers.
+# Columns follow COLUMNS (int32 for id/frame, float32 otherwise) and are
+# followed by 'offsets': uint32[pedestrians + 1], the row range of each
+# pedestrian. Rows are grouped by pedestrian like in to_dict().
+BINARY_MAGIC = b'JPST'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sIfIIII')
+
+# Quantized layout (?quantize=), version 2: the header above followed by
+# float32 step (metres per unit), uint32 bytes per coordinate (2 or 4) and
+# uint32 frame stride, then the column offsets and buffers in the order of
+# version 1 and three int32[pedestrians] buffers 'x0', 'y0', 'z0' with the
+# first position of every pedestrian in units of step. Within each
+# pedestrian, x/y/z hold the difference to the previous row in units of
+# step (0 in the first row). A and B are in units of step, angle in
+# hundredths of a degree (int16) and color is uint8. Every buffer starts
+# at a multiple of 4 bytes.
+QUANTIZED_VERSION = 2
+QUANTIZED_HEADER = struct.Struct('<4sIfIIIIfII')
+ANGLE_STEP = 0.01
+DELTA_COLUMNS = ['x', 'y', 'z']
+
+# Arrays of the frame index, persisted next to the columns
+INDEX_ARRAYS = ['frame_order', 'frames', 'frame_offsets']
+
+# Largest piece of a growing file parsed by one TrajectoryTail.read
+TAIL_READ_BYTES = 16 * 1024 * 1024
+
+
+class Trajectory:
+    """ Struct-of-arrays representation of a trajectory file
+
+    Every column is a 1-D numpy array with one entry per data row, in
+    file order. The nested JSON shape used by the viewers is derived
+    from the columns on demand by :meth:`to_dict`.
+
+    A frame index is built once on construction: frame_order lists the
+    rows sorted by frame, and the rows of frames[k] are
+    frame_order[frame_offsets[k]:frame_offsets[k + 1]].
+    """
+
+    def __init__(self, columns, framerate=None, frame_index=None):
+        self.columns = columns
+        self.framerate = framerate
+        if frame_index is None:
+            self.build_frame_index()
+        else:
+            self.frame_order, self.frames, self.frame_offsets = frame_index
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def build_frame_index(self):
+        self.frame_order = np.argsort(self.columns['frame'], kind='stable')
+        self.frames, counts = np.unique(self.columns['frame'][self.frame_order], return_counts=True)
+        self.frame_offsets = np.zeros(len(self.frames) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.frame_offsets[1:])
+
+    def pedestrian_ids(self):
+        """ Sorted unique pedestrian ids """
+        return np.unique(self.columns['id'])
+
+    def frame_range(self):
+        """ First and last frame number, or (0, -1) for an empty trajectory """
+        if len(self) == 0:
+            return 0, -1
+        return int(self.frames[0]), int(self.frames[-1])
+
+    def frame_slice(self, first, last):
+        """ Positions [lo, hi) in self.frames of the frames within [first, last] """
+        lo = np.searchsorted(self.frames, first, side='left')
+        hi = np.searchsorted(self.frames, last, side='right')
+        return lo, max(lo, hi)
+
+    def rows_in_frames(self, first, last, stride=1):
+        """ Row indices of the frames within [first, last], ordered by frame
+
+        :param stride: keep every stride-th frame, starting with the first one
+        """
+        lo, hi = self.frame_slice(first, last)
+        rows = self.frame_order[self.frame_offsets[lo]:self.frame_offsets[hi]]
+        if stride > 1:
+            counts = np.diff(self.frame_offsets[lo:hi + 1])
+            rows = rows[np.repeat(np.arange(hi - lo) % stride == 0, counts)]
+        return rows
+
+    def decimated_framerate(self, stride):
+        """ Framerate of every stride-th frame, None if unknown """
+        return None if self.framerate is None else self.framerate / stride
+
+    def rows_by_pedestrian(self, rows=None):
+        """ Group row indices by pedestrian
+
+        Ids need neither be contiguous nor sorted in the file. Rows of one
+        pedestrian keep their order in <rows>.
+
+        :param rows: row indices to group, all rows if None
+        :returns: (ids, order, offsets) where the rows of ids[k] are
+                  order[offsets[k]:offsets[k + 1]]
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        order = rows[np.argsort(self.columns['id'][rows], kind='stable')]
+        ids, counts = np.unique(self.columns['id'][order], return_counts=True)
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return ids, order, offsets
+
+    def locations(self, rows):
+        """ Location dictionaries (as served in JSON) of the given rows """
+        c = self.columns
+        ped_id = c['id'][rows].astype(str).tolist()
+        x, y, z = c['x'][rows].tolist(), c['y'][rows].tolist(), c['z'][rows].tolist()
+        a, b = c['A'][rows].tolist(), c['B'][rows].tolist()
+        angle, color = c['angle'][rows].tolist(), c['color'][rows].tolist()
+
+        return [
+            {
+                'coordinate': {'x': x[i], 'y': y[i], 'z': z[i]},
+                'axes': {'A': a[i], 'B': b[i]},
+                'angle': angle[i],
+                'color': color[i],
+                'id': ped_id[i]
+            }
+            for i in range(len(ped_id))
+        ]
+
+    def to_dict(self, rows=None, stride=1):
+        """ Build the {'framerate', 'pedestrians'} dictionary served as JSON
+
+        pedestrians[k] holds the locations of the k-th smallest id.
+
+        :param rows: row indices to include, all rows if None
+        :param stride: frame stride of <rows>, see rows_in_frames
+        """
+        ids, order, offsets = self.rows_by_pedestrian(rows)
+        locations = self.locations(order)
+        pedestrians = [locations[offsets[k]:offsets[k + 1]] for k in range(len(ids))]
+
+        trajectory = {'pedestrians': pedestrians}
+        if self.framerate is not None:
+            trajectory['framerate'] = self.decimated_framerate(stride)
+        if stride > 1:
+            trajectory['stride'] = stride
+        return trajectory
+
+    def iter_frames(self, first, last, batch_size=100, stride=1):
+        """ Yield lists of {'frame', 'locations'} for the frames within [first, last]
+
+        Location dictionaries are only built for one batch of <batch_size>
+        frames at a time, so callers can serialize and send a batch before
+        the next one is created.
+
+        :param stride: yield every stride-th frame, starting with the first one
+        """
+        lo, hi = self.frame_slice(first, last)
+        positions = range(lo, hi, stride)
+        for start in range(0, len(positions), batch_size):
+            batch = np.asarray(positions[start:start + batch_size])
+            starts = self.frame_offsets[batch]
+            stops = self.frame_offsets[batch + 1]
+            if stride == 1:
+                rows = self.frame_order[starts[0]:stops[-1]]
+            else:
+                rows = np.concatenate([self.frame_order[a:b] for a, b in zip(starts, stops)])
+            locations = self.locations(rows)
+            bounds = np.concatenate([[0], np.cumsum(stops - starts)])
+            yield [
+                {
+                    'frame': int(self.frames[k]),
+                    'locations': locations[bounds[j]:bounds[j + 1]]
+                }
+                for j, k in enumerate(batch)
+            ]
+
+    def window_header(self, first, last, stride=1):
+        header = {'from': first, 'to': last}
+        if self.framerate is not None:
+            header['framerate'] = self.decimated_framerate(stride)
+        if stride > 1:
+            header['stride'] = stride
+        return header
+
+    def to_frames_dict(self, first, last, stride=1):
+        """ Build the frame-major dictionary of /trajectory?from=&to=
+
+        :returns: {'framerate', 'from', 'to', 'frames': [{'frame', 'locations'}]},
+                  plus 'stride' if frames are skipped
+        """
+        trajectory = self.window_header(first, last, stride)
+        trajectory['frames'] = [frame for batch in self.iter_frames(first, last, stride=stride)
+                                for frame in batch]
+        return trajectory
+
+    def to_binary(self, rows=None, stride=1):
+        """ Encode the columns as the little-endian buffers of /trajectory.bin
+
+        :param rows: row indices to encode (e.g. a frame window), all rows if None
+        :param stride: frame stride of <rows>, see rows_in_frames
+        """
+        ids, order, offsets = self.rows_by_pedestrian(rows)
+        buffers = []
+        for name in COLUMNS:
+            dtype = '<i4' if name in INT_COLUMNS else '<f4'
+            buffers.append(self.columns[name][order].astype(dtype).tobytes())
+        buffers.append(offsets.astype('<u4').tobytes())
+
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, self.binary_framerate(stride),
+                                    len(order), self.frame_count(order), len(ids), len(buffers))
+        return pack_buffers(header, buffers)
+
+    def check_quantization(self, step):
+        """ Raise ValueError unless all coordinates fit the quantized layout with <step> """
+        for name in DELTA_COLUMNS:
+            if magnitude([np.round(self.columns[name] / step).astype(np.int64)]) > np.iinfo(np.int32).max // 2:
+                raise ValueError('coordinates exceed the quantized range, use a larger step')
+
+    def to_quantized_binary(self, rows=None, stride=1, step=0.001):
+        """ Encode the columns in the quantized layout of /trajectory.bin?quantize=
+
+        Coordinates are rounded to multiples of <step> metres and sent as
+        differences along each pedestrian's path, which fit into int16 for
+        all but very coarse frame strides.
+
+        :param rows: row indices to encode, all rows if None
+        :param stride: frame stride of <rows>, see rows_in_frames
+        :param step: quantization step in metres
+        """
+        ids, order, offsets = self.rows_by_pedestrian(rows)
+        # First row of every pedestrian
+        starts = offsets[:-1]
+
+        quantized = {}
+        first_positions = []
+        for name in DELTA_COLUMNS:
+            values = np.round(self.columns[name][order] / step).astype(np.int64)
+            if magnitude([values]) > np.iinfo(np.int32).max // 2:
+                raise ValueError('coordinates exceed the quantized range, use a larger step')
+            deltas = np.zeros_like(values)
+            deltas[1:] = values[1:] - values[:-1]
+            deltas[starts] = 0
+            quantized[name] = deltas
+            first_positions.append(values[starts])
+        for name in ['A', 'B']:
+            quantized[name] = np.round(self.columns[name][order] / step).astype(np.int64)
+
+        fits_int16 = magnitude(quantized.values()) <= np.iinfo(np.int16).max
+        coordinate_type = '<i2' if fits_int16 else '<i4'
+
+        angle = np.mod(self.columns['angle'][order] + 180, 360) - 180
+        buffers = [
+            self.columns['id'][order].astype('<i4').tobytes(),
+            self.columns['frame'][order].astype('<i4').tobytes(),
+        ]
+        buffers += [quantized[name].astype(coordinate_type).tobytes() for name in DELTA_COLUMNS + ['A', 'B']]
+        buffers += [
+            np.round(angle / ANGLE_STEP).astype('<i2').tobytes(),
+            np.clip(np.round(self.columns['color'][order]), 0, 255).astype('u1').tobytes(),
+            offsets.astype('<u4').tobytes(),
+        ]
+        buffers += [values.astype('<i4').tobytes() for values in first_positions]
+
+        header = QUANTIZED_HEADER.pack(BINARY_MAGIC, QUANTIZED_VERSION, self.binary_framerate(stride),
+                                       len(order), self.frame_count(order), len(ids), len(buffers),
+                                       step, np.dtype(coordinate_type).itemsize, stride)
+        return pack_buffers(header, buffers)
+
+    def binary_framerate(self, stride):
+        framerate = self.decimated_framerate(stride)
+        return float('nan') if framerate is None else framerate
+
+    def frame_count(self, rows):
+        return len(np.unique(self.columns['frame'][rows]))
+
+
+def magnitude(arrays):
+    """ Largest absolute value in <arrays>, 0 if all are empty """
+    return max([int(np.abs(a).max()) for a in arrays if len(a)] + [0])
+
+
+def pack_buffers(header, buffers):
+    """ Header, uint32 offset of every buffer, then the buffers at multiples of 4 bytes """
+    position = len(header) + 4 * len(buffers)
+    column_offsets = []
+    parts = []
+    for buf in buffers:
+        column_offsets.append(position)
+        padding = -len(buf) % 4
+        parts += [buf, b'\0' * padding]
+        position += len(buf) + padding
+
+    return b''.join([header, struct.pack('<{}I'.format(len(buffers)), *column_offsets)] + parts)
+
+
+def read_header(filepath):
+    """ Read the leading '#' comment lines and return the framerate (or None) """
+    framerate = None
+    with open(filepath, 'r') as f:
+        for line in f:
+            if line.startswith('#framerate:'):
+                framerate = float(line.split()[1])
+            elif line.strip() and not line.startswith('#'):
+                break
+    return framerate
+
+
+def empty_columns():
+    return {name: np.zeros(0, dtype=np.int32 if name in INT_COLUMNS else np.float64)
+            for name in COLUMNS}
+
+
+def read_columns(source):
+    """ Columns of the data rows of a file name or file object, '#' lines are skipped """
+    dtypes = {name: np.int32 if name in INT_COLUMNS else np.float64 for name in COLUMNS}
+    try:
+        df = pd.read_csv(source, sep='\t', comment='#', header=None,
+                         names=COLUMNS, usecols=range(len(COLUMNS)),
+                         dtype=dtypes, skip_blank_lines=True, engine='c')
+    except pd.errors.EmptyDataError:
+        return empty_columns()
+    return {name: df[name].to_numpy() for name in COLUMNS}
+
+
+def load_trajectory(filepath):
+    """ Parse a trajectory file into columns in a single vectorized pass
+
+    :param filepath: JuPedSim trajectory file (tab separated)
+    :returns: Trajectory
+    """
+    return Trajectory(read_columns(filepath), read_header(filepath))
+
+
+def grow(buffer, size, values):
+    """ Write <values> behind the first <size> entries of <buffer>
+
+    The buffer is replaced by one of twice the needed size when full, so
+    appending n rows one piece at a time copies O(n) entries in total.
+
+    :returns: the buffer holding the size + len(values) entries
+    """
+    end = size + len(values)
+    if end > len(buffer):
+        larger = np.empty(2 * end, dtype=buffer.dtype)
+        larger[:size] = buffer[:size]
+        buffer = larger
+    buffer[size:end] = values
+    return buffer
+
+
+class TrajectoryTail:
+    """ Incremental reader of a trajectory file that is still being written
+
+    read() parses the complete lines appended since the last call, starting
+    at the byte offset where that call stopped; a partly written last line
+    is left for the next call. append() adds the parsed rows to the columns,
+    moves the offset past them and extends the frame index, which stays valid as long as frames are
+    written in order (JuPedSim writes them one after the other). Only rows
+    of earlier frames make the index be rebuilt.
+
+    trajectory is a Trajectory of all rows read so far.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.framerate = None
+        # Whether the first data row has not been read yet
+        self.header = True
+        self.more = False
+        self.clear()
+
+    def clear(self):
+        self.size = 0
+        self.buffers = empty_columns()
+        self.order_buffer = np.zeros(0, dtype=np.int64)
+        self.trajectory = Trajectory(empty_columns())
+
+    def read(self):
+        """ Parse the complete lines appended since the last read, may run in a thread
+
+        The offset only moves in append(), rows of a read that is never
+        appended are read again by the next call.
+
+        :returns: (columns of the new rows, whether the file was truncated
+                   and is read from its start again, offset after the rows)
+        """
+        truncated = os.path.getsize(self.filepath) < self.offset
+        offset = 0 if truncated else self.offset
+        with open(self.filepath, 'rb') as f:
+            f.seek(offset)
+            data = f.read(TAIL_READ_BYTES)
+        # Whether the file holds more than one read
+        self.more = len(data) == TAIL_READ_BYTES
+        # Up to the last complete line
+        data = data[:data.rfind(b'\n') + 1]
+
+        if truncated:
+            self.header = True
+        if self.header:
+            # The header may be split over several reads
+            for line in data.split(b'\n'):
+                if line.startswith(b'#framerate:'):
+                    self.framerate = float(line.split()[1])
+                elif line.strip() and not line.startswith(b'#'):
+                    self.header = False
+                    break
+        columns = read_columns(io.BytesIO(data)) if data.strip() else empty_columns()
+        return columns, truncated, offset + len(data)
+
+    def append(self, columns, truncated=False, offset=None):
+        """ Add rows parsed by read() to the trajectory
+
+        :param truncated: as returned by read(), drops the rows read before
+        :param offset: as returned by read(), where the next read starts
+        :returns: (first, last) frame with new rows, None if there are none
+        """
+        if offset is not None:
+            self.offset = offset
+        if truncated:
+            self.clear()
+        n = len(columns['id'])
+        if n == 0:
+            return None
+        start = self.size
+        for name in COLUMNS:
+            self.buffers[name] = grow(self.buffers[name], start, columns[name])
+        self.size = start + n
+        views = {name: self.buffers[name][:self.size] for name in COLUMNS}
+
+        old = self.trajectory
+        order = np.argsort(columns['frame'], kind='stable')
+        frames, counts = np.unique(columns['frame'][order], return_counts=True)
+        changed = int(frames[0]), int(frames[-1])
+        if len(old.frames) and frames[0] < old.frames[-1]:
+            self.trajectory = Trajectory(views, self.framerate)
+            self.order_buffer = self.trajectory.frame_order.copy()
+            return changed
+
+        self.order_buffer = grow(self.order_buffer, start, order + start)
+        ends = start + np.cumsum(counts)
+        if len(old.frames) and frames[0] == old.frames[-1]:
+            # More rows of the last frame
+            frames = np.concatenate([old.frames, frames[1:]])
+            offsets = np.concatenate([old.frame_offsets[:-1], ends])
+        else:
+            frames = np.concatenate([old.frames, frames])
+            offsets = np.concatenate([old.frame_offsets, ends])
+        frame_index = (self.order_buffer[:self.size], frames, offsets)
+        self.trajectory = Trajectory(views, self.framerate, frame_index)
+        return changed
+
+
+def load_array(filepath):
+    """ Memory-map a .npy file, numpy cannot map empty arrays """
+    try:
+        return np.load(filepath, mmap_mode='r')
+    except ValueError:
+        return np.load(filepath)
+
+
+def save_trajectory(traj, directory):
+    """ Store columns, frame index and framerate of <traj> as .npy files in <directory> """
+    for name in COLUMNS:
+        np.save(os.path.join(directory, name + '.npy'), traj.columns[name])
+    for name in INDEX_ARRAYS:
+        np.save(os.path.join(directory, name + '.npy'), getattr(traj, name))
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'framerate': traj.framerate}, f)
+
+
+def open_trajectory(directory):
+    """ Open a trajectory stored by save_trajectory with memory-mapped columns """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    columns = {name: load_array(os.path.join(directory, name + '.npy')) for name in COLUMNS}
+    frame_index = [load_array(os.path.join(directory, name + '.npy')) for name in INDEX_ARRAYS]
+    return Trajectory(columns, meta['framerate'], frame_index)